@@ -0,0 +1,29 @@
+"""Checks that every builder directory ships the same copy of `healpix_hdf5.py`.
+
+`datasets` only copies local imports found next to a loading script, so the
+SDSS and HSC builders each carry a real copy of the module instead of a link
+to a shared file. Run from anywhere after editing one of the copies:
+
+    python check_healpix_hdf5.py
+"""
+import filecmp
+import glob
+import os
+import sys
+
+
+def main():
+    root = os.path.dirname(os.path.abspath(__file__))
+    copies = sorted(glob.glob(os.path.join(root, "*", "healpix_hdf5.py")))
+    if not copies:
+        sys.exit(f"No copies of healpix_hdf5.py found under {root}")
+    reference = copies[0]
+    differing = [path for path in copies[1:] if not filecmp.cmp(reference, path, shallow=False)]
+    if differing:
+        names = ", ".join(os.path.relpath(path, root) for path in differing)
+        sys.exit(f"Copies differing from {os.path.relpath(reference, root)}: {names}; copy the edited file over the others.")
+    print(f"{len(copies)} copies of healpix_hdf5.py are identical")
+
+
+if __name__ == "__main__":
+    main()
@@ -14,9 +14,10 @@
 import datasets
 from datasets import Features, Value, Array2D, Sequence
 from datasets.data_files import DataFilesPatternsDict
-import h5py
 import numpy as np
 
+from .healpix_hdf5 import HealpixHDF5ExampleMixin
+
 # TODO: Add BibTeX citation
 # Find for instance the citation on arxiv or on the dataset repo/website
 _CITATION = r"""% CITATION
@@ -146,7 +147,19 @@ _FLOAT_FEATURES = [
     ]
 
 
-class HSC(datasets.GeneratorBasedBuilder):
+# Per-band image arrays, one row per object
+_IMAGE_DATASETS = [
+    'image_band',
+    'image_array',
+    'image_ivar',
+    'image_mask',
+    'image_psf_fwhm',
+    'image_scale',
+]
+
+
+# The Arrow-based variant producing the same dataset is `HSCArrow` in hsc_arrow.py
+class HSC(HealpixHDF5ExampleMixin, datasets.GeneratorBasedBuilder):
     """TODO: Short description of my dataset."""
 
     VERSION = _VERSION
@@ -164,6 +177,9 @@ class HSC(datasets.GeneratorBasedBuilder):
 
     _bands = ['G', 'R', 'I', 'Z', 'Y']
 
+    # Number of catalog rows read per HDF5 call when generating examples (images are large)
+    _block_rows = 128
+
     @classmethod
     def _info(self):
         """ Defines the features available in this dataset.
@@ -198,47 +214,31 @@ class HSC(datasets.GeneratorBasedBuilder):
             citation=_CITATION,
         )
 
-    def _split_generators(self, dl_manager):
-        """We handle string, list and dicts in datafiles"""
-        if not self.config.data_files:
-            raise ValueError(f"At least one data file must be specified, but got data_files={self.config.data_files}")
-        splits = []
-        for split_name, files in self.config.data_files.items():
-            if isinstance(files, str):
-                files = [files]
-            splits.append(datasets.SplitGenerator(name=split_name, gen_kwargs={"files": files})) 
-        return splits
-
-    def _generate_examples(self, files, object_ids=None):
-        """ Yields examples as (key, example) tuples.
+    @classmethod
+    def _block_datasets(cls):
+        """ Names of the HDF5 datasets needed to build an example.
+        """
+        return _IMAGE_DATASETS + _FLOAT_FEATURES + ["object_id"]
+
+    def _block_examples(self, block):
+        """ Yields (key, example) tuples for every row of a block read by `_read_block`.
         """
-        for j, file in enumerate(files):
-            with h5py.File(file, "r") as data:
-                if object_ids is not None:
-                    keys = object_ids[j]
-                else:
-                    keys = data["object_id"]
-                
-                # Preparing an index for fast searching through the catalog
-                sort_index = np.argsort(data["object_id"])
-                sorted_ids = data["object_id"][:][sort_index]
-
-                for k in keys:
-                    # Extract the indices of requested ids in the catalog 
-                    i = sort_index[np.searchsorted(sorted_ids, k)]
-                    # Parse image data
-                    example = {'image':  [{'band': data['image_band'][i][j].decode('utf-8'),
-                               'flux': data['image_array'][i][j],
-                               'ivar': data['image_ivar'][i][j],
-                               'mask': data['image_mask'][i][j],
-                               'psf_fwhm': data['image_psf_fwhm'][i][j],
-                               'scale': data['image_scale'][i][j]} for j, _ in enumerate( self._bands )]
-                    }
-                    # Add all other requested features
-                    for f in _FLOAT_FEATURES:
-                        example[f] = data[f][i].astype('float32')
-                    
-                    # Add object_id
-                    example["object_id"] = str(data["object_id"][i])
-
-                    yield str(data['object_id'][i]), example
+        float_features = {f: block[f].astype('float32') for f in _FLOAT_FEATURES}
+
+        for k, object_id in enumerate(block["object_id"]):
+            # Parse image data
+            example = {'image':  [{'band': block['image_band'][k][j].decode('utf-8'),
+                       'flux': block['image_array'][k][j],
+                       'ivar': block['image_ivar'][k][j],
+                       'mask': block['image_mask'][k][j],
+                       'psf_fwhm': block['image_psf_fwhm'][k][j],
+                       'scale': block['image_scale'][k][j]} for j, _ in enumerate( self._bands )]
+            }
+            # Add all other requested features
+            for f, values in float_features.items():
+                example[f] = values[k]
+
+            # Add object_id
+            example["object_id"] = str(object_id)
+
+            yield str(object_id), example
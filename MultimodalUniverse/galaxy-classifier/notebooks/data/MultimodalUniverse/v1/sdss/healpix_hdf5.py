@@ -0,0 +1,334 @@
+# Copyright 2020 The HuggingFace Datasets Authors and the current dataset script contributor.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Block-wise reading of healpix-partitioned HDF5 catalogs, shared by the SDSS and HSC builders.
+
+`datasets` only copies local imports found next to a loading script, so each
+builder directory ships its own copy of this file and imports it as
+`.healpix_hdf5`. The copies must stay identical: edit one, copy it over the
+others and run `v1/check_healpix_hdf5.py`.
+"""
+import abc
+import datasets
+from datasets.table import InMemoryTable, table_cast
+import os
+import time
+import h5py
+import numpy as np
+import pyarrow as pa
+
+logger = datasets.logging.get_logger(__name__)
+
+# Requested rows spanning at most this many times their count are read as one contiguous slab
+DENSE_READ_RATIO = 4
+
+
+def object_id_index(file, data=None):
+    """Returns (sorted_ids, sort_index) for the object_id column of an HDF5 file.
+
+    The index is cached next to the file as `<file>.index.npz` and rebuilt when
+    the modification time or size of the file changes. `data` is the file when
+    it is already open.
+    """
+    index_path = f"{file}.index.npz"
+    stat = os.stat(file)
+    signature = np.array([stat.st_mtime_ns, stat.st_size], dtype=np.int64)
+    if os.path.exists(index_path):
+        try:
+            with np.load(index_path, allow_pickle=False) as index:
+                if np.array_equal(index["signature"], signature):
+                    return index["sorted_ids"], index["sort_index"]
+        except (OSError, KeyError, ValueError):
+            pass  # Unreadable index, rebuilt below
+
+    if data is None:
+        with h5py.File(file, "r") as f:
+            catalog_ids = f["object_id"][:]
+    else:
+        catalog_ids = data["object_id"][:]
+    sort_index = np.argsort(catalog_ids, kind="stable")
+    sorted_ids = catalog_ids[sort_index]
+
+    # Written to a temporary file first so that concurrent readers never load a partial index
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            np.savez(f, signature=signature, sorted_ids=sorted_ids, sort_index=sort_index)
+        os.replace(tmp_path, index_path)
+    except OSError as e:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        logger.warning(f"Could not write the object_id index {index_path}: {e}")
+    return sorted_ids, sort_index
+
+
+def lookup_rows(sorted_ids, sort_index, object_ids):
+    """Maps object ids to row indices through a sorted index, raising KeyError for unknown ids.
+
+    Ids of another kind (e.g. str ids against a bytes catalog) are converted
+    without a fixed length: casting to the catalog dtype would truncate longer
+    ids and could match them to a different object.
+    """
+    object_ids = np.asarray(object_ids)
+    if object_ids.dtype.kind != sorted_ids.dtype.kind:
+        object_ids = object_ids.astype(sorted_ids.dtype.kind if sorted_ids.dtype.kind in "SU" else sorted_ids.dtype)
+    if len(sorted_ids) == 0:
+        positions = np.zeros(len(object_ids), dtype=np.int64)
+        found = np.zeros(len(object_ids), dtype=bool)
+    else:
+        positions = np.minimum(np.searchsorted(sorted_ids, object_ids), len(sorted_ids) - 1)
+        found = sorted_ids[positions] == object_ids
+    if not found.all():
+        raise KeyError(f"{np.count_nonzero(~found)} unknown object ids, e.g. {object_ids[~found][:5].tolist()}")
+    return sort_index[positions]
+
+
+class ObjectIdIndex:
+    """Global object_id -> (file, row) index over several HDF5 files.
+
+    Built by merging the per-file indexes of `object_id_index`, so no catalog
+    is read again once their sidecars exist.
+    """
+
+    def __init__(self, files):
+        self.files = list(files)
+        if not self.files:
+            raise ValueError("At least one data file is required to build an object_id index.")
+        ids, file_index, rows = [], [], []
+        for j, file in enumerate(self.files):
+            sorted_ids, sort_index = object_id_index(file)
+            ids.append(sorted_ids)
+            file_index.append(np.full(len(sorted_ids), j, dtype=np.int32))
+            rows.append(sort_index)
+        ids = np.concatenate(ids)
+        order = np.argsort(ids, kind="stable")
+        self.sorted_ids = ids[order]
+        self.file_index = np.concatenate(file_index)[order]
+        self.rows = np.concatenate(rows)[order]
+
+    def __len__(self):
+        return len(self.sorted_ids)
+
+    def lookup(self, object_ids):
+        """Returns the file indices (into `self.files`) and rows of `object_ids`, in the given order."""
+        positions = lookup_rows(self.sorted_ids, np.arange(len(self.sorted_ids)), object_ids)
+        return self.file_index[positions], self.rows[positions]
+
+
+def healpix_shards(files):
+    """Groups data files by their healpix directory (e.g. `sdss/healpix=634`), in order of first appearance.
+
+    Each shard is one element of the `shards` list, so `download_and_prepare(num_proc=...)`
+    distributes whole healpix directories across worker processes.
+    """
+    shards = {}
+    for file in files:
+        directory = os.path.dirname(file)
+        name = "/".join([os.path.basename(os.path.dirname(directory)), os.path.basename(directory)])
+        shards.setdefault(directory, {"name": name, "files": []})["files"].append(file)
+    return list(shards.values())
+
+
+class HealpixHDF5Mixin:
+    """Split generation and block-wise reading for builders over healpix-partitioned HDF5 files.
+
+    Builders set `_block_rows` and implement `_block_datasets`, which names the
+    HDF5 datasets needed to build an example, along with the hook of the
+    `HealpixHDF5ExampleMixin` or `HealpixHDF5TableMixin` they derive from. A
+    builder class leaving any of these hooks abstract raises TypeError when it
+    is defined.
+    """
+
+    # Number of catalog rows read per HDF5 call
+    _block_rows = 4096
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # `DatasetBuilder` does not use ABCMeta, so abstract hooks are checked here rather than at instantiation
+        if issubclass(cls, datasets.DatasetBuilder):
+            missing = sorted(name for name in dir(cls)
+                             if getattr(getattr(cls, name, None), "__isabstractmethod__", False))
+            if missing:
+                raise TypeError(f"{cls.__name__} must implement {', '.join(missing)}")
+
+    @classmethod
+    @abc.abstractmethod
+    def _block_datasets(cls):
+        """Names of the HDF5 datasets needed to build an example."""
+
+    def _split_generators(self, dl_manager):
+        """We handle string, list and dicts in datafiles"""
+        if not self.config.data_files:
+            raise ValueError(
+                f"At least one data file must be specified, but got data_files={self.config.data_files}"
+            )
+        splits = []
+        for split_name, files in self.config.data_files.items():
+            if isinstance(files, str):
+                files = [files]
+            splits.append(
+                datasets.SplitGenerator(name=split_name, gen_kwargs={"shards": healpix_shards(files)})
+            )
+        return splits
+
+    def object_id_index(self, split="train"):
+        """Returns the `ObjectIdIndex` over every data file of `split`, built once per builder."""
+        indexes = vars(self).setdefault("_object_id_indexes", {})
+        if split not in indexes:
+            indexes[split] = ObjectIdIndex(self.config.data_files[split])
+        return indexes[split]
+
+    def _iter_subset_blocks(self, object_ids, split="train"):
+        """Yields (positions, block) pairs covering `object_ids`.
+
+        `positions` holds the indices in `object_ids` of the rows of `block`. The ids are resolved
+        to (file, row) through `object_id_index`; each file is opened once and its rows are read in
+        increasing order, in blocks of `_block_rows`.
+        """
+        index = self.object_id_index(split)
+        file_index, rows = index.lookup(object_ids)
+        if len(rows) == 0:
+            return
+        # Group the requested rows by file, then sort them within each file for sequential reads
+        order = np.lexsort((rows, file_index))
+        bounds = np.flatnonzero(np.diff(file_index[order])) + 1
+        for file_positions in np.split(order, bounds):
+            with h5py.File(index.files[file_index[file_positions[0]]], "r") as data:
+                for start in range(0, len(file_positions), self._block_rows):
+                    positions = file_positions[start:start + self._block_rows]
+                    yield positions, self._read_block(data, rows[positions])
+
+    @classmethod
+    def _iter_shard_blocks(cls, files=None, object_ids=None, shards=None):
+        """Yields the blocks of every shard and logs the throughput of each shard once read.
+
+        A shard may carry per-file `object_ids` aligned with its `files`; top-level
+        `object_ids` only apply to `files`, since their positions would not match
+        the files of each shard.
+        """
+        if shards is None:
+            shards = [{"name": "files", "files": files, "object_ids": object_ids}]
+        elif object_ids is not None:
+            raise ValueError("object_ids cannot be combined with shards; set per-file 'object_ids' in each shard instead.")
+        for shard in shards:
+            start_time = time.time()
+            n_rows = 0
+            for block in cls._iter_blocks(shard["files"], shard.get("object_ids")):
+                n_rows += len(block["object_id"])
+                yield block
+            elapsed = time.time() - start_time
+            logger.info(f"{shard['name']}: {n_rows} rows from {len(shard['files'])} files "
+                        f"in {elapsed:.1f} s ({n_rows / max(elapsed, 1e-9):.0f} rows/s)")
+
+    @classmethod
+    def _iter_blocks(cls, files, object_ids=None):
+        """Yields the requested rows of every file as blocks of at most `_block_rows` rows.
+
+        `object_ids`, if given, holds one sequence of ids per file of `files`.
+        """
+        if object_ids is not None and len(object_ids) != len(files):
+            raise ValueError(f"Expected one list of object ids per file, got {len(object_ids)} for {len(files)} files.")
+        for j, file in enumerate(files):
+            with h5py.File(file, "r") as data:
+                if object_ids is not None:
+                    # Sorted index of the catalog, cached next to the file
+                    sorted_ids, sort_index = object_id_index(file, data)
+                    rows = lookup_rows(sorted_ids, sort_index, object_ids[j])
+                    n_rows = len(rows)
+                else:
+                    rows = None
+                    n_rows = len(data["object_id"])
+
+                for start in range(0, n_rows, cls._block_rows):
+                    stop = min(start + cls._block_rows, n_rows)
+                    selection = slice(start, stop) if rows is None else rows[start:stop]
+                    yield cls._read_block(data, selection)
+
+    @classmethod
+    def _read_block(cls, data, selection):
+        """Reads the rows in `selection` (a slice or an array of row indices) of every needed dataset.
+
+        Row indices are sorted and deduplicated before reading since h5py only
+        accepts increasing indices; if they cover a dense enough range, the
+        enclosing slab is read in one contiguous call instead.
+        """
+        if isinstance(selection, slice):
+            return {key: data[key][selection] for key in cls._block_datasets()}
+
+        unique_rows, inverse = np.unique(selection, return_inverse=True)
+        if len(unique_rows) == 0:
+            return {key: data[key][0:0] for key in cls._block_datasets()}
+        first, last = int(unique_rows[0]), int(unique_rows[-1]) + 1
+        if last - first <= DENSE_READ_RATIO * len(unique_rows):
+            return {key: data[key][first:last][selection - first] for key in cls._block_datasets()}
+        return {key: data[key][unique_rows][inverse] for key in cls._block_datasets()}
+
+
+class HealpixHDF5ExampleMixin(HealpixHDF5Mixin):
+    """`HealpixHDF5Mixin` for `GeneratorBasedBuilder`s, which implement `_block_datasets` and `_block_examples`."""
+
+    @abc.abstractmethod
+    def _block_examples(self, block):
+        """Yields (key, example) tuples for every row of a block read by `_read_block`."""
+
+    def subset(self, object_ids, split="train"):
+        """Reads the examples of arbitrary `object_ids` (e.g. a cross-match catalog) without preparing the dataset.
+
+        Returns a list of (key, example) tuples in the order of `object_ids`;
+        unknown ids raise KeyError. See `_iter_subset_blocks` for how rows are read.
+        """
+        examples = [None] * len(object_ids)
+        for positions, block in self._iter_subset_blocks(object_ids, split):
+            for position, example in zip(positions, self._block_examples(block)):
+                examples[position] = example
+        return examples
+
+    def _generate_examples(self, files=None, object_ids=None, shards=None):
+        """Yields examples as (key, example) tuples.
+
+        Rows are processed in blocks of `_block_rows`: each block is read with a
+        single HDF5 call per dataset and examples are sliced from memory.
+        Examples come from the healpix `shards` built by `_split_generators`, or
+        from `files` (with optional per-file `object_ids`) when called directly.
+        """
+        for block in self._iter_shard_blocks(files, object_ids, shards):
+            yield from self._block_examples(block)
+
+
+class HealpixHDF5TableMixin(HealpixHDF5Mixin):
+    """`HealpixHDF5Mixin` for `ArrowBasedBuilder`s, which implement `_block_datasets` and `_block_table`."""
+
+    @abc.abstractmethod
+    def _block_table(self, block):
+        """Builds the Arrow table of a block read by `_read_block`."""
+
+    def subset(self, object_ids, split="train"):
+        """Reads the rows of arbitrary `object_ids` (e.g. a cross-match catalog) without preparing the dataset.
+
+        Returns a `datasets.Dataset` with one row per id, in the order of `object_ids`;
+        unknown ids raise KeyError. See `_iter_subset_blocks` for how rows are read.
+        """
+        positions, tables = [], []
+        for block_positions, block in self._iter_subset_blocks(object_ids, split):
+            positions.append(block_positions)
+            tables.append(self._block_table(block))
+        if not tables:
+            return datasets.Dataset.from_dict({f: [] for f in self.info.features}, info=self.info.copy())
+        table = pa.concat_tables(tables).take(pa.array(np.argsort(np.concatenate(positions))))
+        table = table_cast(table, self.info.features.arrow_schema)
+        return datasets.Dataset(InMemoryTable(table), info=self.info.copy())
+
+    def _generate_tables(self, files=None, object_ids=None, shards=None):
+        """Yields (key, pyarrow.Table) tuples, one table per block of rows."""
+        for key, block in enumerate(self._iter_shard_blocks(files, object_ids, shards)):
+            yield key, self._block_table(block)
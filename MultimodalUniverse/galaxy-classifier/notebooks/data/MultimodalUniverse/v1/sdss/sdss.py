@@ -15,9 +15,10 @@ import datasets
 from datasets import Features, Value, Sequence
 from datasets.data_files import DataFilesPatternsDict
 import itertools
-import h5py
 import numpy as np
 
+from .healpix_hdf5 import HealpixHDF5ExampleMixin
+
 # TODO: Add BibTeX citation
 # Find for instance the citation on arxiv or on the dataset repo/website
 _CITATION = r"""% CITATION
@@ -114,7 +115,18 @@ _BOOL_FEATURES = [
     "ZWARNING"
 ]
 
-class SDSS(datasets.GeneratorBasedBuilder):
+# Per-pixel spectrum arrays, one row per object
+_SPECTRUM_DATASETS = [
+    "spectrum_flux",
+    "spectrum_ivar",
+    "spectrum_lsf_sigma",
+    "spectrum_lambda",
+    "spectrum_mask",
+]
+
+
+# The Arrow-based variant producing the same dataset is `SDSSArrow` in sdss_arrow.py
+class SDSS(HealpixHDF5ExampleMixin, datasets.GeneratorBasedBuilder):
     """TODO: Short description of my dataset."""
 
     VERSION = _VERSION
@@ -178,6 +190,9 @@ class SDSS(datasets.GeneratorBasedBuilder):
 
     _flux_filters = ['U', 'G', 'R', 'I', 'Z']
 
+    # Number of catalog rows read per HDF5 call when generating examples
+    _block_rows = 4096
+
     @classmethod
     def _info(self):
         """Defines the features available in this dataset."""
@@ -222,64 +237,41 @@ class SDSS(datasets.GeneratorBasedBuilder):
             citation=ACKNOWLEDGEMENTS + "\n" + _CITATION,
         )
 
-    def _split_generators(self, dl_manager):
-        """We handle string, list and dicts in datafiles"""
-        if not self.config.data_files:
-            raise ValueError(
-                f"At least one data file must be specified, but got data_files={self.config.data_files}"
-            )
-        splits = []
-        for split_name, files in self.config.data_files.items():
-            if isinstance(files, str):
-                files = [files]
-            splits.append(
-                datasets.SplitGenerator(name=split_name, gen_kwargs={"files": files})
-            )
-        return splits
-
-    def _generate_examples(self, files, object_ids=None):
-        """Yields examples as (key, example) tuples."""
-        for j, file in enumerate(files):
-            with h5py.File(file, "r") as data:
-                if object_ids is not None:
-                    keys = object_ids[j]
-                else:
-                    keys = data["object_id"][:]
-
-                # Preparing an index for fast searching through the catalog
-                sort_index = np.argsort(data["object_id"][:])
-                sorted_ids = data["object_id"][:][sort_index]
-
-                for k in keys:
-                    # Extract the indices of requested ids in the catalog
-                    i = sort_index[np.searchsorted(sorted_ids, k)]
-
-                    # Parse spectrum data
-                    example = {
-                        "spectrum": {
-                            "flux": data["spectrum_flux"][i].reshape([-1,1]),
-                            "ivar": data["spectrum_ivar"][i].reshape([-1,1]),
-                            "lsf_sigma": data["spectrum_lsf_sigma"][i].reshape([-1,1]),
-                            "lambda": data["spectrum_lambda"][i].reshape([-1,1]),
-                            "mask": data["spectrum_mask"][i].reshape([-1,1]),
-                        }
-                    }
-                    # Add all other requested features
-                    for f in _FLOAT_FEATURES:
-                        value = data[f][i].astype("float32")
-                        example[f] = value.view(value.dtype.newbyteorder('=')) if value.shape else float(value)
-
-                    # Add all other requested features
-                    for f in _FLUX_FEATURES:
-                        for n, b in enumerate(self._flux_filters):
-                            value = data[f"{f}"][i][n].astype("float32")
-                            example[f"{f}_{b}"] = value.view(value.dtype.newbyteorder('=')) if value.shape else float(value)
-
-                    # Add all boolean flags
-                    for f in _BOOL_FEATURES:
-                        example[f] = bool(data[f][i])
-
-                    # Add object_id
-                    example["object_id"] = str(data["object_id"][i])
-
-                    yield str(data["object_id"][i]), example
+    @classmethod
+    def _block_datasets(cls):
+        """Names of the HDF5 datasets needed to build an example."""
+        return _SPECTRUM_DATASETS + _FLOAT_FEATURES + _FLUX_FEATURES + _BOOL_FEATURES + ["object_id"]
+
+    def _block_examples(self, block):
+        """Yields (key, example) tuples for every row of a block read by `_read_block`."""
+        float_features = {f: block[f].astype("float32") for f in _FLOAT_FEATURES}
+        flux_features = {f: block[f].astype("float32") for f in _FLUX_FEATURES}
+
+        for k, object_id in enumerate(block["object_id"]):
+            # Parse spectrum data
+            example = {
+                "spectrum": {
+                    "flux": block["spectrum_flux"][k].reshape([-1,1]),
+                    "ivar": block["spectrum_ivar"][k].reshape([-1,1]),
+                    "lsf_sigma": block["spectrum_lsf_sigma"][k].reshape([-1,1]),
+                    "lambda": block["spectrum_lambda"][k].reshape([-1,1]),
+                    "mask": block["spectrum_mask"][k].reshape([-1,1]),
+                }
+            }
+            # Add all other requested features
+            for f, values in float_features.items():
+                example[f] = values[k] if values.ndim > 1 else float(values[k])
+
+            # Add all other requested features
+            for f, values in flux_features.items():
+                for n, b in enumerate(self._flux_filters):
+                    example[f"{f}_{b}"] = float(values[k, n])
+
+            # Add all boolean flags
+            for f in _BOOL_FEATURES:
+                example[f] = bool(block[f][k])
+
+            # Add object_id
+            example["object_id"] = str(object_id)
+
+            yield str(object_id), example
@@ -0,0 +1,85 @@
+# Copyright 2020 The HuggingFace Datasets Authors and the current dataset script contributor.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Arrow-based loading script for the SDSS dataset.
+
+`datasets.load_dataset` builds the first builder class defined in a loading
+script, so the Arrow-based variant of `SDSS` lives in this script rather than
+in `sdss.py`. Both produce the same dataset; choose this one by loading the
+script by path instead of the directory, e.g.
+
+    load_dataset("path/to/v1/sdss/sdss_arrow.py", "sdss", trust_remote_code=True)
+"""
+import datasets
+import numpy as np
+import pyarrow as pa
+
+from .healpix_hdf5 import HealpixHDF5TableMixin
+from .sdss import SDSS, _BOOL_FEATURES, _FLOAT_FEATURES, _FLUX_FEATURES, _SPECTRUM_DATASETS
+
+
+def _fixed_size_list_array(values, dtype):
+    """Converts a (n_rows, n) NumPy array into an Arrow array of fixed-size lists of length n."""
+    values = np.ascontiguousarray(values, dtype=dtype)
+    return pa.FixedSizeListArray.from_arrays(pa.array(values.reshape(-1)), values.shape[1])
+
+
+class SDSSArrow(HealpixHDF5TableMixin, datasets.ArrowBasedBuilder):
+    """Arrow-based variant of `SDSS` producing the same dataset.
+
+    Each block of rows read by `_iter_blocks` is turned into one Arrow
+    table straight from the NumPy columns (spectra as fixed-size lists), so no
+    per-example Python dicts are built during preparation.
+    """
+
+    VERSION = SDSS.VERSION
+
+    BUILDER_CONFIGS = SDSS.BUILDER_CONFIGS
+
+    DEFAULT_CONFIG_NAME = SDSS.DEFAULT_CONFIG_NAME
+
+    _flux_filters = SDSS._flux_filters
+
+    _info = SDSS._info
+
+    _block_rows = SDSS._block_rows
+
+    _block_datasets = SDSS._block_datasets
+
+    def _block_table(self, block):
+        """Builds the Arrow table of a block read by `_read_block`."""
+        spectrum_dtypes = {"spectrum_mask": np.bool_}
+        columns = {
+            "spectrum": pa.StructArray.from_arrays(
+                [_fixed_size_list_array(block[key], spectrum_dtypes.get(key, np.float32))
+                 for key in _SPECTRUM_DATASETS],
+                names=[key[len("spectrum_"):] for key in _SPECTRUM_DATASETS],
+            )
+        }
+        # Add all values from the catalog
+        for f in _FLOAT_FEATURES:
+            columns[f] = pa.array(np.asarray(block[f], dtype=np.float32))
+
+        # Add all boolean flags
+        for f in _BOOL_FEATURES:
+            columns[f] = pa.array(np.asarray(block[f], dtype=bool))
+
+        # Add all flux values from the catalog
+        for f in _FLUX_FEATURES:
+            values = np.asarray(block[f], dtype=np.float32)
+            for n, b in enumerate(self._flux_filters):
+                columns[f"{f}_{b}"] = pa.array(np.ascontiguousarray(values[:, n]))
+
+        # Same string conversion as SDSS._block_examples
+        columns["object_id"] = pa.array([str(object_id) for object_id in block["object_id"]], pa.string())
+        return pa.table(columns)
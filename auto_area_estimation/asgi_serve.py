@@ -0,0 +1,296 @@
+import argparse
+import asyncio
+import io
+import json
+import os
+import signal
+import socket
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+import model_serve
+import serve_metrics
+from model_serve import (BINARY_MIMETYPE, COLUMNS_HEADER, MODEL_VERSION_HEADER, InvalidRequestError,
+                         binary_to_matrix, guard_prediction_stream, json_to_matrix, open_prediction_stream)
+from serve_metrics import STAGE_SECONDS
+
+# 推論 (特徴量行列の作成と predict) を実行するスレッド数と、同時に受け付けるリクエスト数の上限
+COMPUTE_THREADS = int(os.environ.get("ASGI_COMPUTE_THREADS", str(os.cpu_count() or 1)))
+MAX_PENDING_REQUESTS = int(os.environ.get("ASGI_MAX_PENDING_REQUESTS", "256"))
+
+# イベントループとスレッドプールはプロセスごとに作成する (fork したワーカーには引き継がれないため)
+_executor = None
+_pending = None
+_owner_pid = None
+
+
+def _ensure_worker_state():
+    """現在のプロセス用のスレッドプールとセマフォを作成する。"""
+    global _executor, _pending, _owner_pid
+    if _owner_pid != os.getpid():
+        _executor = ThreadPoolExecutor(max_workers=COMPUTE_THREADS, thread_name_prefix="predict")
+        _pending = asyncio.Semaphore(MAX_PENDING_REQUESTS)
+        _owner_pid = os.getpid()
+
+
+def _json_response(status, payload, version=None):
+    return status, json.dumps(payload).encode("utf-8"), "application/json", version
+
+
+def _handle_predict(body, content_type, accept, column_header, requested_version):
+    """
+    /predict の処理本体。Flask 版と同じリクエスト形式・レスポンス形式を扱う (スレッドプール上で実行される)。
+
+    Returns:
+        tuple: (ステータスコード, レスポンス本文, Content-Type, 使用したモデルのバージョン)。
+    """
+    with model_serve.profiler.maybe_profile("predict"), serve_metrics.REQUEST_SECONDS.time("predict"):
+        response = _predict_response(body, content_type, accept, column_header, requested_version)
+    serve_metrics.REQUESTS_TOTAL.inc("predict", str(response[0]))
+    return response
+
+
+def _predict_response(body, content_type, accept, column_header, requested_version):
+    model, error = model_serve.resolve_model(requested_version)
+    if error is not None:
+        return _json_response(error[0], {"error": error[1]})
+
+    try:
+        try:
+            if content_type == BINARY_MIMETYPE:
+                with STAGE_SECONDS.time("build"):
+                    input_data = binary_to_matrix(body, column_header, model.features)
+            else:
+                try:
+                    with STAGE_SECONDS.time("parse"):
+                        data = json.loads(body) if body else None
+                except ValueError:
+                    return _json_response(400, {"error": "Invalid JSON body"})
+                with STAGE_SECONDS.time("build"):
+                    input_data = json_to_matrix(data, model.features)
+        except InvalidRequestError as e:
+            return _json_response(400, {"error": str(e)})
+        serve_metrics.REQUEST_ROWS.observe(len(input_data), "predict")
+
+        predictions = model_serve.run_prediction(model, input_data)
+
+        with STAGE_SECONDS.time("serialize"):
+            if accept == BINARY_MIMETYPE:
+                return 200, predictions.astype("<f4").tobytes(), BINARY_MIMETYPE, model.version
+            return _json_response(200, {"predicted_area_auto": predictions.tolist()}, model.version)
+
+    except Exception as e:
+        return _json_response(500, {"error": f"Prediction error: {e}"})
+
+
+async def _read_body(receive):
+    chunks = []
+    more_body = True
+    while more_body:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        more_body = message.get("more_body", False)
+    return b"".join(chunks)
+
+
+class _ReceiveStream(io.RawIOBase):
+    def __init__(self, receive, loop):
+        """
+        ASGI の receive() からリクエスト本文を必要な分だけ読み込むファイルオブジェクト。
+
+        スレッドプール上で読み込む前提で、データが足りなくなるたびにイベントループで receive() を待つ。
+        本文全体をメモリに載せないため、/predict/stream の推論と同じ速さでしか受信しない。
+
+        Args:
+            receive (callable): ASGI の receive。
+            loop (asyncio.AbstractEventLoop): receive() を実行するイベントループ。
+        """
+        self._receive = receive
+        self._loop = loop
+        self._buffer = b""
+        self._more_body = True
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer and self._more_body:
+            message = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+            self._buffer = message.get("body", b"")
+            # http.disconnect を受け取った場合も本文の終わりとして扱う
+            self._more_body = message.get("more_body", False)
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+
+async def _handle_predict_stream(headers, receive, send):
+    """
+    /predict/stream の処理。Flask 版と同じ model_serve.open_prediction_stream() を使い、
+    本文の読み込みと推論はスレッドプール上でチャンクごとに進めて、結果をそのまま送信する。
+    """
+    loop = asyncio.get_running_loop()
+    model, error = model_serve.resolve_model(headers.get(MODEL_VERSION_HEADER.lower()))
+    if error is not None:
+        await _send(send, *_json_response(error[0], {"error": error[1]}))
+        return
+
+    content_type = headers.get("content-type", "").split(";")[0].strip()
+    stream = io.BufferedReader(_ReceiveStream(receive, loop))
+    chunks, mimetype = open_prediction_stream(model, content_type, stream)
+
+    # 最初のチャンクまでに検出できるエラー (列の不足など) は通常のエラーレスポンスとして返す
+    try:
+        first_chunk = await loop.run_in_executor(_executor, next, chunks, None)
+    except InvalidRequestError as e:
+        await _send(send, *_json_response(400, {"error": str(e)}))
+        return
+    except Exception as e:
+        await _send(send, *_json_response(500, {"error": f"Prediction error: {e}"}))
+        return
+
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", mimetype.encode("latin-1")),
+                    (MODEL_VERSION_HEADER.lower().encode("latin-1"), model.version.encode("latin-1"))],
+    })
+    chunk = first_chunk
+    remaining = guard_prediction_stream(chunks, mimetype)
+    while chunk is not None:
+        body = chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+        await send({"type": "http.response.body", "body": body, "more_body": True})
+        chunk = await loop.run_in_executor(_executor, next, remaining, None)
+    await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+async def _send(send, status, body, content_type, version=None):
+    headers = [(b"content-type", content_type.encode("latin-1")),
+               (b"content-length", str(len(body)).encode("latin-1"))]
+    if version is not None:
+        headers.append((MODEL_VERSION_HEADER.lower().encode("latin-1"), version.encode("latin-1")))
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": headers,
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            _ensure_worker_state()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    """
+    Flask 版 (model_serve.py) と同じ /predict と /predict/stream を提供する ASGI アプリケーション。
+
+    リクエストの受信と応答はイベントループで行い、CPU を使う推論は上限付きのスレッドプールで実行する。
+    """
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    _ensure_worker_state()
+    headers = {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope["headers"]}
+    method, path = scope["method"], scope["path"]
+
+    if path == "/predict" and method == "POST":
+        body = await _read_body(receive)
+        content_type = headers.get("content-type", "").split(";")[0].strip()
+        # Flask 版の request.accept_mimetypes.best と同じ規則 (q 値の順) で応答形式を選ぶ
+        accept = parse_accept_header(headers.get("accept"), MIMEAccept).best
+        async with _pending:
+            response = await asyncio.get_running_loop().run_in_executor(
+                _executor, _handle_predict, body, content_type, accept,
+                headers.get(COLUMNS_HEADER.lower()), headers.get(MODEL_VERSION_HEADER.lower()))
+        await _send(send, *response)
+    elif path == "/predict/stream" and method == "POST":
+        async with _pending:
+            await _handle_predict_stream(headers, receive, send)
+    elif path == "/metrics" and method == "GET":
+        # ワーカープロセスごとの値を返す (workers > 1 の場合は各ワーカーのメトリクスを集計すること)
+        await _send(send, 200, model_serve.metrics_text().encode("utf-8"), serve_metrics.CONTENT_TYPE)
+    elif path == "/stats" and method == "GET":
+        await _send(send, *_json_response(200, model_serve.serving_stats()))
+    elif path == "/models" and method == "GET":
+        await _send(send, *_json_response(200, model_serve.registry.versions()))
+    else:
+        await _send(send, *_json_response(404, {"error": "Not found"}))
+
+
+def serve(host, port, workers):
+    """
+    ASGI アプリケーションを uvicorn で起動する。
+
+    workers > 1 の場合は、モデルを読み込み済みの親プロセスでソケットを作成してから fork し、
+    各ワーカーが同じソケットで接続を受け付ける。モデルの重みは copy-on-write で共有される。
+
+    Args:
+        host (str): 待ち受けるホスト。
+        port (int): 待ち受けるポート。
+        workers (int): ワーカープロセス数。
+    """
+    import uvicorn
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    def run_worker():
+        uvicorn.Server(uvicorn.Config(app, lifespan="on", access_log=False)).run(sockets=[sock])
+
+    if workers <= 1:
+        run_worker()
+        return
+
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            # ワーカー間で CPU コアを分け合うため、torch のスレッド数を抑える
+            torch.set_num_threads(max(1, (os.cpu_count() or 1) // workers))
+            try:
+                run_worker()
+            finally:
+                os._exit(0)
+        children.append(pid)
+    print(f"Started {workers} workers on {host}:{port}: {children}")
+
+    def forward_signal(signum, frame):
+        for child in children:
+            try:
+                os.kill(child, signum)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, forward_signal)
+    signal.signal(signal.SIGINT, forward_signal)
+    for child in children:
+        os.waitpid(child, 0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="面積推定モデルの推論サーバー (ASGI 版)")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8085)
+    parser.add_argument("--workers", type=int, default=1, help="fork するワーカープロセス数")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers)
@@ -0,0 +1,149 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import h5py
+import numpy as np
+import torch
+
+from model_bundle import FusedLinearModel, ModelBundle
+
+# 予測値を書き出すデータセット (列) の名前
+OUTPUT_KEY = "predicted_area_auto"
+
+# ワーカープロセスごとに読み込んだモデル
+_worker_model = None
+
+
+def load_model(model_path, fused=False):
+    """
+    モデルバンドル (.pth) または融合済みモデル (.npz) を読み込む。
+
+    Args:
+        model_path (str): モデルのパス。
+        fused (bool): True の場合、モデルバンドルを融合済みモデルに変換して NumPy だけで推論する。
+
+    Returns:
+        ModelBundle or FusedLinearModel: 読み込んだモデル。
+    """
+    if model_path.endswith(".npz"):
+        return FusedLinearModel.load(model_path)
+    bundle = ModelBundle.load(model_path)
+    return bundle.fuse() if fused else bundle
+
+
+def read_features(h5_file, features, start, stop):
+    """
+    HDF5 ファイルから指定した行範囲の特徴量を、列ごとに 1 回の連続読み込みで取得する。
+
+    Returns:
+        np.ndarray: 形状 (stop - start, n_features) の特徴量行列。
+    """
+    return np.column_stack([h5_file[key][start:stop] for key in features]).astype(np.float64, copy=False)
+
+
+def _init_worker(model_path, fused):
+    global _worker_model
+    # プロセスごとに並列化するため、torch のスレッドは 1 つにする
+    torch.set_num_threads(1)
+    _worker_model = load_model(model_path, fused)
+
+
+def _predict_range(args):
+    data_path, start, stop = args
+    with h5py.File(data_path, "r") as f:
+        return start, _worker_model.predict(read_features(f, _worker_model.features, start, stop)).astype(np.float32)
+
+
+def predict_file(data_path, model_path, chunk_rows=262144, workers=1, fused=False):
+    """
+    CEERS 形式の HDF5 ファイル全体を、チャンクごとにベクトル化して推論する。
+
+    Args:
+        data_path (str): 入力の HDF5 ファイルのパス。
+        model_path (str): モデルバンドル (.pth) または融合済みモデル (.npz) のパス。
+        chunk_rows (int): 1 回に読み込む行数。
+        workers (int): 行範囲ごとに推論を分担するプロセス数。1 の場合は現在のプロセスで実行する。
+        fused (bool): True の場合、融合済みモデルで推論する。
+
+    Returns:
+        np.ndarray: 形状 (n_rows,) の float32 の予測値。
+    """
+    model = load_model(model_path, fused)
+    with h5py.File(data_path, "r") as f:
+        missing = [key for key in model.features if key not in f]
+        if missing:
+            raise KeyError(f"Missing required features in {data_path}: {missing}")
+        n_rows = len(f[model.features[0]])
+        mismatched = [key for key in model.features if len(f[key]) != n_rows]
+        if mismatched:
+            raise ValueError(f"Features in {data_path} must have the same length as {model.features[0]}: {mismatched}")
+
+        predictions = np.empty(n_rows, dtype=np.float32)
+        ranges = [(start, min(start + chunk_rows, n_rows)) for start in range(0, n_rows, chunk_rows)]
+
+        if workers <= 1:
+            for start, stop in ranges:
+                predictions[start:stop] = model.predict(read_features(f, model.features, start, stop))
+            return predictions
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(model_path, fused)) as executor:
+        for start, chunk in executor.map(_predict_range, [(data_path, start, stop) for start, stop in ranges]):
+            predictions[start:start + len(chunk)] = chunk
+    return predictions
+
+
+def write_hdf5(path, predictions, overwrite=False):
+    """
+    予測値を HDF5 ファイルのデータセット predicted_area_auto として書き込む (ファイルが無ければ作成する)。
+    """
+    with h5py.File(path, "a") as f:
+        if OUTPUT_KEY in f:
+            if not overwrite:
+                raise FileExistsError(f"{OUTPUT_KEY} already exists in {path} (use --overwrite)")
+            del f[OUTPUT_KEY]
+        f.create_dataset(OUTPUT_KEY, data=predictions)
+
+
+def write_parquet(path, predictions, data_path=None, id_column=None):
+    """
+    予測値を Parquet ファイルに書き込む。id_column を指定した場合は入力ファイルのその列も一緒に書き出す。
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    columns = {}
+    if id_column is not None:
+        with h5py.File(data_path, "r") as f:
+            ids = f[id_column][:]
+        # Arrow はビッグエンディアンの配列を扱えないため、ネイティブのバイトオーダーに変換する
+        columns[id_column] = ids.astype(ids.dtype.newbyteorder("="), copy=False)
+    columns[OUTPUT_KEY] = predictions
+    pq.write_table(pa.table(columns), path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="CEERS 形式の HDF5 ファイルを HTTP を介さずに一括推論する")
+    parser.add_argument("data", help="入力の HDF5 ファイル")
+    parser.add_argument("--model", default="area_model_bundle.pth", help="モデルバンドル (.pth) または融合済みモデル (.npz)")
+    parser.add_argument("--output", default=None,
+                        help="出力先 (.parquet なら Parquet、それ以外は HDF5)。省略時は入力ファイルに書き込む")
+    parser.add_argument("--chunk-rows", type=int, default=262144, help="1 回に読み込む行数")
+    parser.add_argument("--workers", type=int, default=1, help="推論を分担するプロセス数")
+    parser.add_argument("--fused", action="store_true", help="スケーラーを重みに畳み込み、NumPy だけで推論する")
+    parser.add_argument("--id-column", default=None, help="Parquet に一緒に書き出す ID 列")
+    parser.add_argument("--overwrite", action="store_true", help="既存の predicted_area_auto を上書きする")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    predictions = predict_file(args.data, args.model, args.chunk_rows, args.workers, args.fused)
+    elapsed = time.time() - start_time
+    print(f"Predicted {len(predictions)} rows in {elapsed:.2f} s ({len(predictions) / max(elapsed, 1e-9):.0f} rows/s)")
+
+    output = args.output if args.output is not None else args.data
+    if os.path.splitext(output)[1] == ".parquet":
+        write_parquet(output, predictions, args.data, args.id_column)
+    else:
+        write_hdf5(output, predictions, args.overwrite)
+    print(f"Predictions written to {output}")
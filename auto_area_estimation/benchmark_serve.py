@@ -0,0 +1,375 @@
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import torch
+from sklearn.preprocessing import StandardScaler
+
+from model_bundle import DEFAULT_FEATURES, LinearRegressionModel, save_model_bundle
+
+# model_serve.py と同じリクエスト形式 (model_serve を import するとモデルの読み込みが走るため値を持つ)
+BINARY_MIMETYPE = "application/octet-stream"
+COLUMNS_HEADER = "X-Feature-Columns"
+
+# 合成データの各特徴量の分布 (CEERS カタログの値の桁に合わせた対数正規分布の (mu, sigma)。xy_image のみ正規分布)
+SYNTHETIC_DISTRIBUTIONS = {
+    "x2_image": ("lognormal", 1.5, 1.0),
+    "y2_image": ("lognormal", 1.5, 1.0),
+    "cxx_image": ("lognormal", -1.5, 1.0),
+    "cyy_image": ("lognormal", -1.5, 1.0),
+    "fluxerr_auto": ("lognormal", -3.0, 1.0),
+    "flux_radius": ("lognormal", 1.0, 0.5),
+    "area_iso": ("lognormal", 3.5, 1.0),
+    "xy_image": ("normal", 0.0, 2.0),
+    "npix": ("lognormal", 3.5, 1.0),
+    "flux_aper_1": ("lognormal", -1.0, 1.5),
+}
+
+# 比較時に悪化とみなす指標 (値が大きいほど悪い指標は True)
+COMPARED_METRICS = {
+    "latency_p50_ms": True,
+    "latency_p95_ms": True,
+    "latency_p99_ms": True,
+    "rows_per_second": False,
+    "cpu_us_per_row": True,
+}
+
+
+class SyntheticCeersGenerator:
+    def __init__(self, features=DEFAULT_FEATURES, seed=0):
+        """
+        CEERS カタログと同じ列を持つ合成の特徴量を生成する。
+
+        Args:
+            features (list): 生成する特徴量の列名。
+            seed (int): 乱数のシード。
+        """
+        self.features = list(features)
+        self.rng = np.random.default_rng(seed)
+
+    def matrix(self, n_rows):
+        """形状 (n_rows, n_features) の float64 の特徴量行列を返す。"""
+        columns = []
+        for feature in self.features:
+            kind, loc, scale = SYNTHETIC_DISTRIBUTIONS.get(feature, ("lognormal", 0.0, 1.0))
+            if kind == "normal":
+                columns.append(self.rng.normal(loc, scale, n_rows))
+            else:
+                columns.append(self.rng.lognormal(loc, scale, n_rows))
+        return np.column_stack(columns)
+
+
+def make_synthetic_bundle(path, generator, version="benchmark"):
+    """
+    合成データで標準化の統計量を計算し、ランダムな重みのモデルバンドルを作成する。
+
+    Args:
+        path (str): 保存先のパス。
+        generator (SyntheticCeersGenerator): 特徴量の生成器。
+        version (str): モデルのバージョン。
+    """
+    torch.manual_seed(0)
+    model = LinearRegressionModel(len(generator.features), 1)
+    scaler = StandardScaler().fit(generator.matrix(10000))
+    save_model_bundle(path, model.state_dict(), scaler, generator.features, version=version)
+
+
+def parse_batch_sizes(spec):
+    """
+    "1:0.5,32:0.3,1024:0.2" 形式のバッチサイズ (1 リクエストあたりの行数) の分布を解析する。
+
+    Returns:
+        tuple: (バッチサイズの配列, 確率の配列)。
+    """
+    sizes, weights = [], []
+    for item in spec.split(","):
+        size, _, weight = item.partition(":")
+        sizes.append(int(size))
+        weights.append(float(weight) if weight else 1.0)
+    weights = np.array(weights)
+    return np.array(sizes), weights / weights.sum()
+
+
+def encode_request(matrix, features, request_format):
+    """
+    特徴量行列を /predict のリクエスト (本文とヘッダー) に変換する。
+
+    Args:
+        matrix (np.ndarray): 形状 (n_rows, n_features) の特徴量行列。
+        features (list): 特徴量の列名。
+        request_format (str): "rows" (辞書のリスト)・"columns" (列指向の JSON)・"binary" (float32) のいずれか。
+
+    Returns:
+        tuple: (本文, ヘッダーの辞書)。
+    """
+    if request_format == "binary":
+        return matrix.astype("<f4").tobytes(), {"Content-Type": BINARY_MIMETYPE, COLUMNS_HEADER: ",".join(features)}
+    if request_format == "columns":
+        payload = {f: matrix[:, i].tolist() for i, f in enumerate(features)}
+    else:
+        payload = [dict(zip(features, row)) for row in matrix.tolist()]
+    return json.dumps(payload).encode("utf-8"), {"Content-Type": "application/json"}
+
+
+def process_cpu_seconds(pid):
+    """
+    /proc からプロセスとその子プロセス (fork した ASGI ワーカー) の CPU 時間 (user + system、秒) を合計する。
+
+    Returns:
+        float or None: CPU 時間。/proc が無い環境では None。
+    """
+    if not os.path.isdir("/proc"):
+        return None
+    ticks = os.sysconf("SC_CLK_TCK")
+    total = 0.0
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # 2 番目の項目 (コマンド名) は空白を含みうるため、最後の ")" 以降を分割する
+                fields = f.read().rsplit(")", 1)[1].split()
+        except (FileNotFoundError, ProcessLookupError, IndexError):
+            continue
+        if int(entry) == pid or int(fields[1]) == pid:
+            total += (int(fields[11]) + int(fields[12])) / ticks
+    return total
+
+
+def start_server(server, bundle_path, port, workers, env):
+    """
+    推論サーバーを子プロセスとして起動し、/models に応答するまで待つ。
+
+    Args:
+        server (str): "flask" (model_serve.py) または "asgi" (asgi_serve.py)。
+        bundle_path (str): モデルバンドルのパス。
+        port (int): 待ち受けるポート。
+        workers (int): ASGI 版のワーカープロセス数。
+        env (dict): 追加の環境変数 (MICRO_BATCH_WINDOW_MS など)。
+
+    Returns:
+        subprocess.Popen: 起動したサーバーのプロセス。
+    """
+    module_dir = os.path.dirname(os.path.abspath(__file__))
+    if server == "asgi":
+        command = [sys.executable, "asgi_serve.py", "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers)]
+    else:
+        # デバッグモード (リローダー) を使わずに起動する
+        command = [sys.executable, "-c",
+                   f"import model_serve; model_serve.app.run(host='127.0.0.1', port={port}, threaded=True)"]
+    process = subprocess.Popen(command, cwd=module_dir, env={**os.environ, "MODEL_BUNDLE_PATH": bundle_path, **env},
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/models")
+            if connection.getresponse().status == 200:
+                return process
+        except OSError:
+            pass
+        time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("Server did not become ready within 60 s")
+
+
+def run_load(port, requests, concurrency, duration, warmup):
+    """
+    concurrency 個のクライアントスレッドから、用意したリクエストを順に送り続ける。
+
+    Args:
+        port (int): サーバーのポート。
+        requests (list): (本文, ヘッダー, 行数) のリスト。
+        concurrency (int): 同時に送信するクライアント数。
+        duration (float): 計測する秒数。
+        warmup (float): 計測前に送信し続ける秒数 (結果には含めない)。
+
+    Returns:
+        dict: 計測区間のレイテンシ (秒) の配列・行数・エラー数。
+    """
+    start_at = time.perf_counter() + warmup
+    stop_at = start_at + duration
+    results = [{"latencies": [], "rows": 0, "errors": 0} for _ in range(concurrency)]
+
+    def client(index):
+        result = results[index]
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        i = index
+        while True:
+            body, headers, n_rows = requests[i % len(requests)]
+            i += concurrency
+            sent = time.perf_counter()
+            if sent >= stop_at:
+                break
+            try:
+                connection.request("POST", "/predict", body=body, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                ok = response.status == 200
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+                ok = False
+            if sent < start_at:
+                continue
+            if ok:
+                result["latencies"].append(time.perf_counter() - sent)
+                result["rows"] += n_rows
+            else:
+                result["errors"] += 1
+        connection.close()
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {
+        "latencies": np.array([latency for result in results for latency in result["latencies"]]),
+        "rows": sum(result["rows"] for result in results),
+        "errors": sum(result["errors"] for result in results),
+    }
+
+
+def git_commit(path):
+    """path を含むリポジトリの HEAD のコミットと、未コミットの変更の有無を返す。"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=path, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=path,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+
+def run_benchmark(args):
+    """ベンチマークを 1 回実行し、設定と結果の辞書を返す。"""
+    generator = SyntheticCeersGenerator(seed=args.seed)
+    sizes, probabilities = parse_batch_sizes(args.batch_sizes)
+    batch_sizes = generator.rng.choice(sizes, size=args.pool_size, p=probabilities)
+    requests = [encode_request(generator.matrix(n), generator.features, args.format) + (int(n),) for n in batch_sizes]
+
+    env = dict(item.split("=", 1) for item in args.env)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        bundle_path = os.path.join(tmp_dir, "benchmark_bundle.pth")
+        make_synthetic_bundle(bundle_path, generator)
+        process = start_server(args.server, bundle_path, args.port, args.workers, env)
+        try:
+            cpu_before = None
+
+            # ウォームアップ終了時点の CPU 時間を記録するため、計測区間の開始時に別スレッドで読み取る
+            def record_cpu():
+                nonlocal cpu_before
+                cpu_before = process_cpu_seconds(process.pid)
+            timer = threading.Timer(args.warmup, record_cpu)
+            timer.start()
+            load = run_load(args.port, requests, args.concurrency, args.duration, args.warmup)
+            cpu_after = process_cpu_seconds(process.pid)
+            timer.join()
+        finally:
+            process.terminate()
+            process.wait()
+
+    latencies_ms = load["latencies"] * 1000
+    cpu_seconds = cpu_after - cpu_before if cpu_before is not None and cpu_after is not None else None
+    return {
+        "config": {
+            "server": args.server,
+            "workers": args.workers,
+            "format": args.format,
+            "concurrency": args.concurrency,
+            "batch_sizes": args.batch_sizes,
+            "duration": args.duration,
+            "warmup": args.warmup,
+            "seed": args.seed,
+            "env": env,
+        },
+        "results": {
+            "requests": len(latencies_ms),
+            "rows": load["rows"],
+            "errors": load["errors"],
+            "latency_p50_ms": float(np.percentile(latencies_ms, 50)) if len(latencies_ms) else None,
+            "latency_p95_ms": float(np.percentile(latencies_ms, 95)) if len(latencies_ms) else None,
+            "latency_p99_ms": float(np.percentile(latencies_ms, 99)) if len(latencies_ms) else None,
+            "latency_max_ms": float(latencies_ms.max()) if len(latencies_ms) else None,
+            "requests_per_second": len(latencies_ms) / args.duration,
+            "rows_per_second": load["rows"] / args.duration,
+            "cpu_seconds": cpu_seconds,
+            "cpu_us_per_row": cpu_seconds / load["rows"] * 1e6 if cpu_seconds is not None and load["rows"] else None,
+        },
+    }
+
+
+def compare(baseline, current, threshold):
+    """
+    2 つのベンチマーク結果を比較して表示する。
+
+    Args:
+        baseline (dict): 比較元の結果。
+        current (dict): 今回の結果。
+        threshold (float): 悪化とみなす変化率 (0.1 なら 10%)。
+
+    Returns:
+        list: threshold を超えて悪化した指標名のリスト。
+    """
+    if baseline["config"] != current["config"]:
+        print("Warning: benchmark configurations differ; the comparison may not be meaningful.")
+    print(f"{'metric':<20}{'baseline':>14}{'current':>14}{'change':>10}")
+    regressions = []
+    for metric, higher_is_worse in COMPARED_METRICS.items():
+        before, after = baseline["results"].get(metric), current["results"].get(metric)
+        if before is None or after is None or before == 0:
+            continue
+        change = (after - before) / before
+        if (change if higher_is_worse else -change) > threshold:
+            regressions.append(metric)
+        print(f"{metric:<20}{before:>14.3f}{after:>14.3f}{change:>+10.1%}")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="合成の CEERS 形式データで推論サーバーの負荷試験を行う")
+    parser.add_argument("--server", choices=["flask", "asgi"], default="flask")
+    parser.add_argument("--workers", type=int, default=1, help="ASGI 版のワーカープロセス数")
+    parser.add_argument("--port", type=int, default=8185)
+    parser.add_argument("--format", choices=["rows", "columns", "binary"], default="rows", help="リクエストの形式")
+    parser.add_argument("--concurrency", type=int, default=8, help="同時に送信するクライアント数")
+    parser.add_argument("--batch-sizes", default="1:0.6,32:0.3,1024:0.1",
+                        help="1 リクエストあたりの行数の分布 (行数:重み をカンマ区切りで指定)")
+    parser.add_argument("--duration", type=float, default=20.0, help="計測する秒数")
+    parser.add_argument("--warmup", type=float, default=3.0, help="計測前のウォームアップの秒数")
+    parser.add_argument("--pool-size", type=int, default=256, help="事前に作成しておくリクエストの数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="サーバーに渡す環境変数 (MICRO_BATCH_WINDOW_MS=2 など、複数指定可)")
+    parser.add_argument("--output", default=None,
+                        help="結果の保存先 (省略時は benchmark_results/<コミット>.json)")
+    parser.add_argument("--compare", default=None, metavar="BASELINE_JSON", help="比較元の結果ファイル")
+    parser.add_argument("--threshold", type=float, default=0.1, help="悪化とみなす変化率")
+    args = parser.parse_args()
+
+    commit, dirty = git_commit(os.path.dirname(os.path.abspath(__file__)))
+    result = {"commit": commit, "dirty": dirty, "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"), **run_benchmark(args)}
+    print(json.dumps(result["results"], indent=2))
+
+    output = args.output or os.path.join("benchmark_results", f"{(commit or 'unknown')[:12]}{'-dirty' if dirty else ''}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"Results saved to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), result, args.threshold)
+        if regressions:
+            raise SystemExit(f"Regressions beyond {args.threshold:.0%}: {regressions}")
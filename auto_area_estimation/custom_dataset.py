@@ -1,12 +1,76 @@
+import json  # バンド名の語彙のキャッシュファイルを読み書きするためのライブラリ
+import os  # キャッシュファイルの有効性をファイルの更新日時とサイズで確認するためのライブラリ
+import threading  # 先読みのスレッドから同時にファイルを開かないようにするためのロック
+from collections import deque  # 先読み中のチャンクを順番に保持するためのキュー
+from concurrent.futures import ThreadPoolExecutor  # チャンクをバックグラウンドで読み込むためのスレッドプール
+
 import h5py  # HDF5ファイルの読み書きを行うためのライブラリ
 import torch  # PyTorchのテンソル操作などを行うためのライブラリ
 import numpy as np  # 数値計算を行うためのライブラリ
-from torch.utils.data import Dataset  # PyTorchのデータセットの抽象クラス
+from torch.utils.data import (BatchSampler, DataLoader, Dataset, IterableDataset, RandomSampler,  # PyTorchのデータセットの抽象クラス
+                              SequentialSampler, get_worker_info)
 from sklearn.preprocessing import LabelEncoder  # カテゴリカルなラベルを数値に変換するためのライブラリ
 
+# バンド名の語彙を計算する際に 1 度に読み込む行数
+BAND_READ_CHUNK_ROWS = 1 << 20
+
+# バッチ読み込みで、要求された行数に対する範囲の長さがこの倍率以下なら、範囲全体を 1 回で読み込んでから抜き出す
+# (h5py のファンシーインデックスは行数に比例して遅くなるため、密な場合は連続読み込みの方が速い)
+DENSE_READ_RATIO = 4
+
+# チャンク化されていないファイルを ChunkShuffledHDF5Dataset で読み込む際の 1 チャンクあたりの行数
+DEFAULT_CHUNK_ROWS = 65536
+
+
+def _as_bytes(values):
+    """バンド名の配列 (固定長または可変長のバイト列) を固定長のバイト列の NumPy 配列に変換する。"""
+    values = np.asarray(values)
+    return values if values.dtype.kind == "S" else values.astype("S")
+
+
+def _map_batch(function, *batches):
+    """
+    バッチ (キーごとのテンソルの辞書、(特徴量行列, ターゲット) のタプル、または特徴量行列) の各テンソルに関数を適用する。
+    """
+    if isinstance(batches[0], torch.Tensor):
+        return function(*batches)
+    if isinstance(batches[0], dict):
+        return {key: function(*(batch[key] for batch in batches)) for key in batches[0]}
+    return tuple(function(*values) if values[0] is not None else None for values in zip(*batches))
+
+
+def _batch_len(batch):
+    """バッチの行数を返す。"""
+    if isinstance(batch, torch.Tensor):
+        return len(batch)
+    return len(next(iter(batch.values())) if isinstance(batch, dict) else batch[0])
+
+
+def batch_loader(dataset, batch_size, shuffle=False, drop_last=False, **kwargs):
+    """
+    HDF5Dataset (または ArrowDataset) のバッチを get_batch() で直接取得する DataLoader を作成する。
+
+    DataLoader(dataset, batch_size=...) の自動バッチングでは、__getitems__ でまとめて読み込んだバッチを
+    既定の collate_fn が行ごとに分けてから積み直すことになる。BatchSampler をサンプラーとして渡し
+    batch_size=None とすることで、読み込んだバッチをそのまま返す。
+
+    Args:
+        dataset (HDF5Dataset): 読み込むデータセット。
+        batch_size (int): 1 バッチの行数。
+        shuffle (bool): エポックごとに行の順序をシャッフルするかどうか。
+        drop_last (bool): True の場合、最後の batch_size に満たないバッチを返さない。
+        **kwargs: DataLoader に渡すその他の引数 (num_workers など)。
+
+    Returns:
+        DataLoader: バッチ (get_batch() と同じ形式) を返す DataLoader。
+    """
+    sampler = RandomSampler(dataset) if shuffle else SequentialSampler(dataset)
+    return DataLoader(dataset, sampler=BatchSampler(sampler, batch_size, drop_last), batch_size=None, **kwargs)
+
 
 class HDF5Dataset(Dataset):
-    def __init__(self, file_path, keys, transform=None):
+    def __init__(self, file_path, keys, transform=None, band_cache=False, swmr=False, cache=None, mmap=True,
+                 rdcc_nbytes=None, features=None, target=None, pin_memory=False):
         """
         HDF5ファイルからデータを読み込むカスタムデータセットクラス。
 
@@ -14,24 +78,243 @@ class HDF5Dataset(Dataset):
             file_path (str): HDF5ファイルのパス。
             keys (list): HDF5ファイルから読み込むキーのリスト。各キーはデータセット内の要素に対応する。
             transform (callable, optional): データに適用する変換関数。デフォルトはNone。
+            band_cache (bool): True の場合、'image_band' の語彙を "<file_path>.bands.json" に保存し、
+                HDF5ファイルの更新日時とサイズが変わっていなければ次回以降はそれを読み込む。
+            swmr (bool): True の場合、書き込み中のファイルを SWMR (single-writer multiple-reader) モードで読み込む。
+            cache (str, optional): "memory" の場合、初期化時に各キーの列全体を 1 回で読み込んで共有メモリ上のテンソルとして保持し、
+                以降はファイルを読まずにスライスで返す (DataLoader のワーカー間でもコピーせずに共有される)。
+            mmap (bool): True の場合、チャンク化・圧縮されていない連続配置のデータセットは h5py を介さず
+                np.memmap で直接読み込む (OS のページキャッシュを同じノードのプロセス間で共有できる)。
+                SWMR モードでは使用しない。
+            rdcc_nbytes (int, optional): h5py のチャンクキャッシュのサイズ (バイト)。省略時は h5py の既定値 (1 MiB)。
+                圧縮されたチャンクを何度も展開し直さないよう、先読みするチャンクが収まる大きさにする。
+            features (list, optional): 指定した場合、辞書ではなく (特徴量行列, ターゲット) のタプルを返す
+                (target を省略した場合は特徴量行列だけを返す)。
+                特徴量行列は features の順に列を並べた float32 のテンソルで、型の変換は列ごとに NumPy で 1 回だけ行う。
+                features と target は keys に含まれる 1 次元のキーであること。
+            target (str, optional): features を指定した場合に、float32 のベクトルとして返すターゲットのキー。
+                省略時は特徴量行列だけを返す。
+            pin_memory (bool): True の場合、features を指定したバッチをページロックされたメモリに作成する
+                (CUDA が利用できない環境では無視する)。
         """
-        self.file_path = file_path  # HDF5ファイルのパスを保存
-        self.keys = keys  # 読み込むキーのリストを保存
-        self.transform = transform  # 適用する変換関数を保存
-        self.band_le = LabelEncoder()  # 'image_band'の値を数値に変換するためのLabelEncoderを初期化
-        self.h5_file = h5py.File(self.file_path, 'r')  # HDF5ファイルを読み取りモードで開く
+        self._init_common(file_path, keys, transform, cache, band_cache=band_cache, swmr=swmr, mmap=mmap,
+                          rdcc_nbytes=rdcc_nbytes)
         self.dataset_len = len(self.h5_file[self.keys[0]])  # データセットの長さを最初のキーのデータの長さから取得
 
         # 全てのキーの長さが同じであることを確認
         for key in keys:
             assert len(self.h5_file[key]) == self.dataset_len, "All keys must have the same length."
 
-        all_bands = []
-        # 全てのサンプルに含まれるバンド名（文字列）を収集
-        for i in range(self.dataset_len):
-            for band in self.h5_file['image_band'][i]:
-                all_bands.append(band.decode('utf-8'))  # バイト文字列をUTF-8でデコードしてリストに追加
-        self.band_le.fit(all_bands)  # 収集した全てのバンド名に基づいてLabelEncoderを学習
+        # 全てのサンプルに含まれるバンド名（バイト列）の語彙を求め、LabelEncoderに設定する
+        # (バイト列の辞書順は UTF-8 でデコードした文字列の順序と一致するため、fit した場合と同じ番号になる)
+        self._set_band_classes(self._band_vocabulary())
+
+        self._init_output(features, target, pin_memory)
+
+        # DataLoader のワーカーに開いたハンドルを引き継がないよう、メタデータの読み込み後に閉じておく
+        self.close()
+
+    def _init_common(self, file_path, keys, transform, cache, band_cache=False, swmr=False, mmap=False, rdcc_nbytes=None):
+        """HDF5Dataset と ArrowDataset で共通の属性を設定する。"""
+        if cache not in (None, "memory"):
+            raise ValueError(f"Unsupported cache mode: {cache}")
+        self.file_path = file_path  # HDF5ファイルのパスを保存
+        self.keys = keys  # 読み込むキーのリストを保存
+        self.transform = transform  # 適用する変換関数を保存
+        self.band_cache = band_cache  # バンド名の語彙をキャッシュファイルに保存するかどうか
+        self.band_le = LabelEncoder()  # 'image_band'の値を数値に変換するためのLabelEncoderを初期化
+        self.swmr = swmr  # SWMR モードで開くかどうか
+        self.rdcc_nbytes = rdcc_nbytes  # チャンクキャッシュのサイズ
+        self.cache = cache  # キャッシュのモード
+        self.mmap = mmap and not swmr  # 連続配置のデータセットを np.memmap で読み込むかどうか
+        self._memmaps = {}  # キーごとの np.memmap (memmap にできないデータセットは None)
+        # HDF5ファイルはプロセスごとに初めて参照した時点で開く (h5_file プロパティを参照)
+        self._h5_file = None
+        self._h5_pid = None
+        # 先読みのスレッドなどから同時に参照された場合に、ファイルや memmap を 2 回開かないためのロック
+        self._open_lock = threading.RLock()
+
+    def _set_band_classes(self, classes):
+        """ソート済みのバンド名 (バイト列) の語彙を LabelEncoder に設定する。"""
+        self.band_classes = classes
+        self.band_le.classes_ = np.array([band.decode('utf-8') for band in classes])
+
+    def _init_output(self, features, target, pin_memory):
+        """出力形式を設定し、キャッシュが有効な場合は列全体を読み込んでおく。"""
+        missing = [key for key in (features or []) + ([target] if target else []) if key not in self.keys]
+        if missing:
+            raise ValueError(f"features and target must be included in keys: {missing}")
+        if features is None and target is not None:
+            raise ValueError("target requires features")
+        self.features = features
+        self.target = target
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+
+        # キャッシュが有効な場合は、各キーの列全体 (features を指定した場合は特徴量行列とターゲット) をテンソルとして読み込んでおく
+        self._columns = None
+        self._matrix = None
+        if self.cache != "memory":
+            return
+        if features is not None:
+            n_rows = self.dataset_len
+            self._matrix = _map_batch(lambda t: t.share_memory_(), self._collate(lambda key: self.column(key)[()], n_rows))
+        else:
+            self._columns = {key: self._to_tensor(key, np.array(self.column(key)[()])).share_memory_() for key in self.keys}
+
+    def _collate(self, read, n_rows):
+        """
+        read(key) で読み込んだ各列を、float32 の特徴量行列とターゲットのベクトルに詰める。
+
+        行列は先に確保しておき、各列を代入する際に型とバイトオーダーを 1 回で変換する。
+
+        Returns:
+            tuple: (形状 (n_rows, len(features)) の特徴量行列, 形状 (n_rows,) のターゲット)。
+                target を指定していない場合は特徴量行列だけを返す。
+        """
+        matrix = torch.empty((n_rows, len(self.features)), dtype=torch.float32, pin_memory=self.pin_memory)
+        matrix_view = matrix.numpy()
+        for j, key in enumerate(self.features):
+            values = read(key)
+            if np.ndim(values) != 1:
+                raise ValueError(f"Feature {key} must have one value per row")
+            matrix_view[:, j] = values
+        if self.target is None:
+            return matrix
+        target = torch.empty(n_rows, dtype=torch.float32, pin_memory=self.pin_memory)
+        target.numpy()[:] = read(self.target)
+        return matrix, target
+
+    @property
+    def h5_file(self):
+        """
+        現在のプロセス用の HDF5 ファイルのハンドル。
+
+        h5py のハンドルは fork した子プロセスと共有できないため、プロセス ID が変わった場合
+        (DataLoader のワーカーなど) はそのプロセスで開き直す。
+        """
+        if self._h5_file is None or self._h5_pid != os.getpid():
+            with self._open_lock:
+                if self._h5_file is None or self._h5_pid != os.getpid():
+                    self._h5_file = h5py.File(self.file_path, 'r', swmr=self.swmr, rdcc_nbytes=self.rdcc_nbytes)  # HDF5ファイルを読み取りモードで開く
+                    self._h5_pid = os.getpid()
+        return self._h5_file
+
+    def close(self):
+        """
+        現在のプロセスで開いている HDF5 ファイルを閉じる (次に参照した時点で開き直す)。
+        """
+        with self._open_lock:
+            if self._h5_file is not None and self._h5_pid == os.getpid():
+                self._h5_file.close()
+            self._h5_file = None
+            self._h5_pid = None
+
+    def __getstate__(self):
+        """
+        spawn で起動した DataLoader のワーカーに渡せるよう、HDF5 ファイルのハンドルを除いて pickle する。
+        """
+        state = self.__dict__.copy()
+        state['_h5_file'] = None
+        state['_h5_pid'] = None
+        state['_memmaps'] = {}  # np.memmap は pickle するとデータ全体がコピーされるため、渡した先で開き直す
+        del state['_open_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open_lock = threading.RLock()
+
+    def column(self, key):
+        """
+        キーのデータセットを返す。
+
+        連続配置でフィルタ (圧縮など) の無いデータセットは、ファイル内のオフセットに対する読み取り専用の
+        np.memmap として返し (コピー無しで参照できる)、それ以外は h5py のデータセットを返す。
+
+        Args:
+            key (str): データセットのキー。
+
+        Returns:
+            np.memmap or h5py.Dataset: キーのデータセット。
+        """
+        if key not in self._memmaps:
+            with self._open_lock:
+                if key not in self._memmaps:
+                    self._memmaps[key] = self._open_memmap(key) if self.mmap else None
+        memmap = self._memmaps[key]
+        return memmap if memmap is not None else self.h5_file[key]
+
+    def _open_memmap(self, key):
+        """データセットが memmap で読める配置であれば np.memmap を作成し、そうでなければ None を返す。"""
+        dataset = self.h5_file[key]
+        if dataset.chunks is not None or dataset.external or dataset.dtype.hasobject or dataset.size == 0:
+            return None
+        offset = dataset.id.get_offset()  # 領域が確保されていない場合は None
+        if offset is None:
+            return None
+        return np.memmap(self.file_path, dtype=dataset.dtype, mode='r', offset=offset, shape=dataset.shape)
+
+    def read_chunk_rows(self):
+        """
+        1 回の連続読み込みに適した行数 (ChunkShuffledHDF5Dataset の既定のチャンクの行数) を返す。
+
+        Returns:
+            int: データセットのチャンクの行数 (キーごとに異なる場合は最大値、チャンク化されていない場合は DEFAULT_CHUNK_ROWS)。
+        """
+        chunks = [self.h5_file[key].chunks for key in self.keys]
+        return max((c[0] for c in chunks if c is not None), default=DEFAULT_CHUNK_ROWS)
+
+    def _band_vocabulary(self):
+        """
+        'image_band' に含まれるバンド名をまとめて読み込み、重複を除いてソートした語彙を返す。
+
+        Returns:
+            np.ndarray: ソート済みのバンド名 (バイト列) の配列。'image_band' が無い場合は空の配列。
+        """
+        if 'image_band' not in self.h5_file:
+            return np.array([], dtype="S1")
+
+        cache_path = f"{self.file_path}.bands.json"
+        stat = os.stat(self.file_path)
+        signature = [stat.st_mtime, stat.st_size]
+        if self.band_cache and os.path.exists(cache_path):
+            with open(cache_path) as f:
+                cached = json.load(f)
+            if cached.get("signature") == signature:
+                return np.array([band.encode('utf-8') for band in cached["classes"]], dtype="S")
+
+        # 行ごとに読み込まず、チャンク単位でまとめて読み込んで np.unique で重複を除く
+        bands = self.h5_file['image_band']
+        classes = np.array([], dtype="S1")
+        for start in range(0, len(bands), BAND_READ_CHUNK_ROWS):
+            chunk = _as_bytes(bands[start:start + BAND_READ_CHUNK_ROWS])
+            classes = np.union1d(classes, np.unique(chunk))
+
+        if self.band_cache:
+            with open(cache_path, "w") as f:
+                json.dump({"signature": signature, "classes": [band.decode('utf-8') for band in classes]}, f)
+        return classes
+
+    def encode_bands(self, values):
+        """
+        バンド名の配列を、LabelEncoder と同じ番号の配列に変換する。
+
+        Args:
+            values (np.ndarray): バンド名 (バイト列) の配列。
+
+        Returns:
+            np.ndarray: 各バンド名の番号 (int64) の配列。
+
+        Raises:
+            ValueError: 語彙に含まれないバンド名がある場合。
+        """
+        values = _as_bytes(values)
+        codes = np.searchsorted(self.band_classes, values)
+        found = codes < len(self.band_classes)
+        found[found] = self.band_classes[codes[found]] == values[found]
+        if not found.all():
+            raise ValueError(f"y contains previously unseen labels: {np.unique(values[~found]).tolist()}")
+        return codes.astype(np.int64, copy=False)
 
     def __len__(self):
         """
@@ -46,17 +329,29 @@ class HDF5Dataset(Dataset):
         """
         指定されたインデックスのデータを取得する。
 
+        インデックスのリスト (BatchSampler が返すもの) を渡した場合は get_batch() と同じく、
+        キーごとに 1 回の読み込みでまとめて取得し、行方向に積み重ねたテンソルを返す。
+
         Args:
-            index (int): 取得するデータのインデックス。
+            index (int or list): 取得するデータのインデックス、またはインデックスのリスト。
 
         Returns:
             dict: データの辞書。キーは初期化時に指定されたキーに対応し、値は対応するデータ。
+                features を指定した場合は (特徴量ベクトル, ターゲット) のタプル (target を省略した場合は特徴量ベクトル)。
         """
+        if isinstance(index, (list, tuple, np.ndarray, torch.Tensor)):
+            return self.get_batch(index)
+        if self.features is not None:
+            return _map_batch(lambda value: value[0], self.get_batch([index]))
+        if self._columns is not None:
+            return {key: column[index] for key, column in self._columns.items()}
         data = {}  # データを格納する空の辞書を初期化
         for key in self.keys:
-            value = self.h5_file[key][index][()]  # HDF5ファイルから指定されたキーとインデックスのデータを読み込む
+            value = self.column(key)[index][()]  # HDF5ファイルから指定されたキーとインデックスのデータを読み込む
+            if isinstance(value, np.memmap):
+                value = np.array(value)  # memmap の行はファイルへの読み取り専用のビューのため、通常の配列にコピー
             if key == "image_band":
-                data[key] = torch.from_numpy(self.band_le.transform(value)).long()  # 'image_band'の場合、LabelEncoderで数値に変換し、PyTorchのLongTensorに変換
+                data[key] = torch.from_numpy(self.encode_bands(value))  # 'image_band'の場合、語彙の番号に変換し、PyTorchのLongTensorに変換
             elif isinstance(value, np.ndarray):
                 data[key] = torch.from_numpy(value).float()  # NumPy配列の場合、PyTorchのFloatTensorに変換
             elif isinstance(value, (np.float16, np.float32, np.float64)):
@@ -69,9 +364,307 @@ class HDF5Dataset(Dataset):
                 data[key] = torch.tensor(value)  # その他の型の場合、PyTorchのテンソルに変換
         return data  # 読み込んだデータを格納した辞書を返す
 
+    def get_batch(self, indices):
+        """
+        複数のインデックスのデータを、キーごとに 1 回の読み込みでまとめて取得する。
+
+        インデックスは重複を除いてソートしてから読み込み、要求された順序に並べ直して返す。
+        batch_loader() (DataLoader(dataset, sampler=BatchSampler(...), batch_size=None)) を使うと、
+        行ごとの読み込みと collate を経由せずにバッチを取得できる。
+
+        Args:
+            indices (list or np.ndarray): 取得するデータのインデックス。
+
+        Returns:
+            dict: キーごとに、形状 (len(indices), ...) のテンソル。
+                features を指定した場合は (形状 (len(indices), len(features)) の特徴量行列, ターゲット) のタプル
+                (target を省略した場合は特徴量行列)。
+        """
+        indices = np.asarray(indices, dtype=np.int64).reshape(-1)
+        if len(indices) == 0:
+            raise IndexError("indices must not be empty")
+        indices = np.where(indices < 0, indices + self.dataset_len, indices)
+        if indices.min() < 0 or indices.max() >= self.dataset_len:
+            raise IndexError(f"Index out of range for dataset of length {self.dataset_len}")
+        if self._matrix is not None:
+            positions = torch.from_numpy(indices)
+            return _map_batch(lambda value: value[positions], self._matrix)
+        if self._columns is not None:
+            positions = torch.from_numpy(indices)
+            return {key: column[positions] for key, column in self._columns.items()}
+        unique, inverse = np.unique(indices, return_inverse=True)
+        if self.features is not None:
+            return self._collate(lambda key: self._read_rows(key, unique)[inverse], len(indices))
+        return {key: self._to_tensor(key, self._read_rows(key, unique)[inverse]) for key in self.keys}
+
+    def __getitems__(self, indices):
+        """
+        DataLoader が自動バッチング時に呼び出すバッチ取得メソッド。
+
+        get_batch() でキーごとに 1 回だけ読み込み、既定の collate_fn がそのまま使えるよう行ごとのデータのリストとして返す。
+        collate_fn は行ごとのテンソルを積み直すため、その分のコピーも避けたい場合は batch_loader() を使う。
+
+        Args:
+            indices (list): 取得するデータのインデックス。
+
+        Returns:
+            list: 各インデックスのデータ (__getitem__ と同じ形式) のリスト。
+        """
+        batch = self.get_batch(indices)
+        return [_map_batch(lambda value: value[i], batch) for i in range(len(indices))]
+
+    def to_numpy(self, keys=None):
+        """
+        指定したキーの列全体を、__getitem__ と同じ型の NumPy 配列としてまとめて取得する。
+
+        Args:
+            keys (list, optional): 取得するキー。省略時は初期化時に指定したキー全て。
+
+        Returns:
+            dict: キーごとに、形状 (len(self), ...) の NumPy 配列。
+        """
+        keys = self.keys if keys is None else keys
+        if self._columns is not None and all(key in self._columns for key in keys):
+            return {key: self._columns[key].numpy() for key in keys}
+        return {key: self._to_tensor(key, np.array(self.column(key)[()])).numpy() for key in keys}
+
+    def to_dataframe(self, keys=None):
+        """
+        指定したキーの列全体を pandas の DataFrame としてまとめて取得する。
+
+        Args:
+            keys (list, optional): 取得するキー。省略時は初期化時に指定したキー全て。
+
+        Returns:
+            pd.DataFrame: 各キーを列とする DataFrame。
+
+        Raises:
+            ValueError: 1 行あたり複数の値を持つキー ('image_band' など) が含まれる場合。
+        """
+        import pandas as pd
+
+        columns = self.to_numpy(keys)
+        multi_dimensional = [key for key, values in columns.items() if values.ndim != 1]
+        if multi_dimensional:
+            raise ValueError(f"Keys with more than one value per row cannot be converted to a DataFrame: {multi_dimensional}")
+        return pd.DataFrame(columns)
+
+    def _read_rows(self, key, unique):
+        """ソート済みで重複の無いインデックスの行を読み込む。"""
+        dataset = self.column(key)
+        start, stop = int(unique[0]), int(unique[-1]) + 1
+        if stop - start <= DENSE_READ_RATIO * len(unique):
+            values = dataset[start:stop]
+            return values if stop - start == len(unique) else values[unique - start]
+        return dataset[unique]
+
+    def _to_tensor(self, key, values):
+        """まとめて読み込んだ配列を、__getitem__ と同じ型のテンソルに変換する。"""
+        if key == "image_band":
+            return torch.from_numpy(self.encode_bands(values))
+        if values.dtype.kind in "SUO":
+            raise TypeError(f"Unsupported type for key {key}: {values.dtype}")
+        # torch はネイティブ以外のバイトオーダーの配列を扱えないため変換する
+        values = values.astype(values.dtype.newbyteorder("="), copy=False)
+        if values.dtype.kind == "f" or values.ndim > 1:
+            return torch.from_numpy(values).float()
+        return torch.from_numpy(values)
+
     def __del__(self):
         """
         オブジェクトが削除される際にHDF5ファイルを閉じる。
         """
-        if hasattr(self, 'h5_file') and self.h5_file:
-            self.h5_file.close()
\ No newline at end of file
+        if hasattr(self, '_h5_file'):
+            self.close()
+
+# ArrowDataset の filters で指定できる比較演算子
+_FILTER_OPERATORS = {
+    "==": lambda field, value: field == value,
+    "!=": lambda field, value: field != value,
+    "<": lambda field, value: field < value,
+    "<=": lambda field, value: field <= value,
+    ">": lambda field, value: field > value,
+    ">=": lambda field, value: field >= value,
+}
+
+
+class ArrowDataset(HDF5Dataset):
+    def __init__(self, path, keys, transform=None, filters=None, dropna=False, cache=None,
+                 features=None, target=None, pin_memory=False):
+        """
+        hdf5_to_parquet.py で変換した Parquet データセットからデータを読み込む、HDF5Dataset と同じインターフェースのデータセット。
+
+        keys の列だけを読み込み (列の射影)、filters と dropna の条件は Arrow のスキャン時に適用する。
+        範囲の条件は行グループの統計量で判定され、条件に合わない行グループは読み込まない。
+        条件に合った行は初期化時にメモリに読み込み、インデックスは条件に合った行の通し番号になる。
+
+        Args:
+            path (str): Parquet ファイル、またはそれを含むディレクトリのパス。
+            keys (list): 読み込む列名のリスト。
+            transform (callable, optional): データに適用する変換関数。デフォルトはNone。
+            filters (list, optional): (列名, 演算子, 値) のリスト。全ての条件を満たす行だけを読み込む。
+                演算子は "==", "!=", "<", "<=", ">", ">=" のいずれか。
+            dropna (bool or list): True の場合は keys の、リストの場合はその列の値が欠損 (null または NaN) の行を除く
+                (ceers_training.ipynb の df.dropna() に相当)。
+            cache (str, optional): "memory" の場合、初期化時に全ての列をテンソルに変換しておく。
+            features (list, optional): HDF5Dataset と同じく、(特徴量行列, ターゲット) のタプルを返す場合の特徴量のキー。
+            target (str, optional): ターゲットのキー。
+            pin_memory (bool): バッチをページロックされたメモリに作成するかどうか。
+        """
+        import pyarrow.dataset as ds
+
+        self._init_common(path, keys, transform, cache)
+        dataset = ds.dataset(path, format="parquet")
+        table = dataset.to_table(columns=list(keys), filter=self._filter_expression(dataset.schema, keys, filters, dropna))
+        self._arrays = {key: self._column_to_numpy(table.column(key)) for key in keys}
+        self.dataset_len = table.num_rows
+        # 読み込み時のレコードバッチ (Parquet の行グループに対応) の行数
+        self._batch_rows = max((batch.num_rows for batch in table.to_batches()), default=0) or DEFAULT_CHUNK_ROWS
+
+        # バンド名の語彙は、読み込んだ行に含まれるバンド名から求める
+        if 'image_band' in self._arrays:
+            self._set_band_classes(np.unique(_as_bytes(self._arrays['image_band'])))
+        else:
+            self._set_band_classes(np.array([], dtype="S1"))
+
+        self._init_output(features, target, pin_memory)
+
+    @staticmethod
+    def _filter_expression(schema, keys, filters, dropna):
+        """filters と dropna の条件を Arrow の式に変換する (条件が無い場合は None)。"""
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+
+        terms = []
+        for column, operator, value in filters or []:
+            if operator not in _FILTER_OPERATORS:
+                raise ValueError(f"Unsupported filter operator: {operator}")
+            terms.append(_FILTER_OPERATORS[operator](ds.field(column), value))
+        for column in (keys if dropna is True else dropna or []):
+            field_type = schema.field(column).type
+            if pa.types.is_list(field_type) or pa.types.is_fixed_size_list(field_type):
+                continue
+            terms.append(ds.field(column).is_valid())
+            if pa.types.is_floating(field_type):
+                terms.append(~ds.field(column).is_nan())
+
+        expression = None
+        for term in terms:
+            expression = term if expression is None else expression & term
+        return expression
+
+    @staticmethod
+    def _column_to_numpy(column):
+        """Arrow の列を NumPy 配列に変換する (固定長リストの列は 2 次元の配列にする)。"""
+        import pyarrow as pa
+
+        column = column.combine_chunks()
+        if pa.types.is_fixed_size_list(column.type):
+            values = column.flatten().to_numpy(zero_copy_only=False)
+            return values.reshape(len(column), column.type.list_size)
+        return column.to_numpy(zero_copy_only=False)
+
+    def column(self, key):
+        """キーの列を、読み込み済みの NumPy 配列として返す。"""
+        return self._arrays[key]
+
+    def read_chunk_rows(self):
+        """1 回の連続読み込みに適した行数として、読み込み時のレコードバッチの行数を返す。"""
+        return self._batch_rows
+
+    def close(self):
+        """ファイルのハンドルを持たないため何もしない。"""
+
+
+class ChunkShuffledHDF5Dataset(IterableDataset):
+    def __init__(self, dataset, batch_size=1024, shuffle=True, seed=None, chunk_rows=None,
+                 prefetch_chunks=4, num_threads=2, drop_last=False):
+        """
+        HDF5Dataset をチャンク単位でシャッフルしながら順に読み込み、バッチを返すデータセット。
+
+        行単位のランダムアクセスでは圧縮されたチャンクを何度も展開し直すことになるため、
+        チャンクの順序をシャッフルし、各チャンクは 1 回の連続読み込みで取得してからチャンク内の行をシャッフルする。
+        次に使うチャンクはスレッドプールで先読みし (最大 prefetch_chunks 個)、学習の計算と読み込みを重ねる。
+        DataLoader(dataset, batch_size=None) のように使い、num_workers > 0 の場合はワーカーごとにチャンクを分担する。
+        全てのワーカーが同じシードでチャンクの順序を決めてから分担するため、各行はエポックごとにちょうど 1 回ずつ読み込まれる。
+
+        num_workers > 0 の場合、__iter__ はワーカー側のコピーで実行され、エポック番号の更新は親プロセスに反映されない。
+        エポックごとに異なる順序にするには、各エポックの前に set_epoch(epoch) を呼び出すこと
+        (persistent_workers=True の場合は set_epoch() がワーカーに届かないが、ワーカー側でエポック番号が進む)。
+
+        Args:
+            dataset (HDF5Dataset): 読み込むデータセット (ArrowDataset も可)。
+            batch_size (int): 1 バッチの行数。
+            shuffle (bool): チャンクの順序とチャンク内の行をシャッフルするかどうか。
+            seed (int, optional): シャッフルの乱数のシード。エポックごとに seed + エポック番号を使う。
+                省略時は初期化時に乱数で決める (DataLoader のワーカー間で同じ値になるように)。
+            chunk_rows (int, optional): 1 回に読み込む行数。省略時は dataset.read_chunk_rows()
+                (HDF5 のチャンク、または Parquet の行グループの行数)。
+            prefetch_chunks (int): 先読みしておくチャンクの数の上限。
+            num_threads (int): 先読みに使うスレッド数。
+            drop_last (bool): True の場合、エポックの最後の batch_size に満たないバッチを返さない。
+        """
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        # ワーカーごとに異なる順序で分担すると行の重複・欠落が起きるため、省略時もここで 1 つに決めておく
+        self.seed = seed if seed is not None else int(np.random.SeedSequence().generate_state(1)[0])
+        self.chunk_rows = chunk_rows or dataset.read_chunk_rows()
+        self.prefetch_chunks = prefetch_chunks
+        self.num_threads = num_threads
+        self.drop_last = drop_last
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        """次のイテレーションで使うエポック番号 (シャッフルの乱数) を設定する。"""
+        self.epoch = epoch
+
+    def __len__(self):
+        """1 エポックのバッチ数 (num_workers > 0 の場合はワーカー間の端数により多少前後する)。"""
+        n_rows = len(self.dataset)
+        return n_rows // self.batch_size if self.drop_last else -(-n_rows // self.batch_size)
+
+    def __iter__(self):
+        epoch = self.epoch
+        self.epoch += 1
+        n_rows = len(self.dataset)
+        ranges = [(start, min(start + self.chunk_rows, n_rows)) for start in range(0, n_rows, self.chunk_rows)]
+        # チャンクの順序は全てのワーカーで同じ乱数から決め、チャンク内の行の順序はワーカーごとの乱数で決める
+        if self.shuffle:
+            ranges = [ranges[i] for i in np.random.default_rng(self.seed + epoch).permutation(len(ranges))]
+        worker = get_worker_info()
+        if worker is not None:
+            ranges = ranges[worker.id::worker.num_workers]
+        rng = np.random.default_rng([self.seed, epoch, worker.id if worker is not None else 0])
+
+        with ThreadPoolExecutor(max_workers=self.num_threads, thread_name_prefix="hdf5-prefetch") as executor:
+            remaining = iter(ranges)
+            pending = deque()
+
+            def prefetch():
+                chunk_range = next(remaining, None)
+                if chunk_range is not None:
+                    pending.append(executor.submit(self.dataset.get_batch, np.arange(*chunk_range)))
+
+            for _ in range(self.prefetch_chunks):
+                prefetch()
+
+            leftover = None
+            while pending:
+                chunk = pending.popleft().result()
+                prefetch()
+
+                if self.shuffle:
+                    order = torch.from_numpy(rng.permutation(_batch_len(chunk)))
+                    chunk = _map_batch(lambda value: value[order], chunk)
+                if leftover is not None:
+                    chunk = _map_batch(lambda previous, value: torch.cat([previous, value]), leftover, chunk)
+
+                n_chunk_rows = _batch_len(chunk)
+                n_full = n_chunk_rows - n_chunk_rows % self.batch_size
+                for start in range(0, n_full, self.batch_size):
+                    yield _map_batch(lambda value: value[start:start + self.batch_size], chunk)
+                leftover = _map_batch(lambda value: value[n_full:], chunk) if n_full < n_chunk_rows else None
+
+            if leftover is not None and not self.drop_last:
+                yield leftover
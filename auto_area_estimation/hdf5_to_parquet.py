@@ -0,0 +1,106 @@
+import argparse
+import glob
+import os
+import time
+
+import h5py
+
+
+def select_columns(h5_file, columns=None):
+    """
+    変換する列を選ぶ。columns を省略した場合は、数値またはバイト列の 1 次元・2 次元のデータセットを全て変換する。
+
+    Args:
+        h5_file (h5py.File): 入力の HDF5 ファイル。
+        columns (list, optional): 変換する列名。
+
+    Returns:
+        list: 変換する列名。
+    """
+    if columns is not None:
+        missing = [key for key in columns if key not in h5_file]
+        if missing:
+            raise KeyError(f"Missing columns in {h5_file.filename}: {missing}")
+        return list(columns)
+    return [key for key, dataset in h5_file.items()
+            if isinstance(dataset, h5py.Dataset) and dataset.ndim in (1, 2) and dataset.dtype.kind in "biufS"]
+
+
+def to_arrow_array(values):
+    """
+    HDF5 から読み込んだ配列を Arrow の配列に変換する。2 次元の配列 ('image_band' など) は固定長リストにする。
+    """
+    import pyarrow as pa
+
+    # Arrow はビッグエンディアンの配列を扱えないため、ネイティブのバイトオーダーに変換する
+    if values.dtype.kind in "biuf":
+        values = values.astype(values.dtype.newbyteorder("="), copy=False)
+    if values.ndim == 1:
+        return pa.array(values)
+    return pa.FixedSizeListArray.from_arrays(pa.array(values.reshape(-1)), values.shape[1])
+
+
+def convert(data_path, output_path, columns=None, row_group_rows=131072, rows_per_file=None, compression="zstd"):
+    """
+    CEERS 形式の HDF5 カタログを Parquet データセットに変換する。
+
+    行グループごとに列の統計量 (最小値・最大値など) を書き込むため、ArrowDataset で範囲の条件を指定すると
+    条件に合わない行グループは読み込まずに済む。
+
+    Args:
+        data_path (str): 入力の HDF5 ファイルのパス。
+        output_path (str): 出力先のディレクトリ。part-00000.parquet のように行範囲ごとのファイルを書き込む
+            (以前の変換で書き込んだ part-*.parquet は削除する)。
+        columns (list, optional): 変換する列名。省略時は変換できる列を全て変換する。
+        row_group_rows (int): 1 行グループの行数 (1 回に HDF5 から読み込む行数も兼ねる)。
+        rows_per_file (int, optional): 1 ファイルあたりの行数。省略時は 1 ファイルに全ての行を書き込む。
+        compression (str): Parquet の圧縮方式。
+
+    Returns:
+        int: 変換した行数。
+
+    Raises:
+        ValueError: 変換する列が無い場合。
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    with h5py.File(data_path, "r") as f:
+        columns = select_columns(f, columns)
+        if not columns:
+            raise ValueError(f"No columns to convert in {data_path}")
+        # 以前の変換のファイルが残っていると、ArrowDataset がそれらの行も読み込んでしまう
+        os.makedirs(output_path, exist_ok=True)
+        for path in glob.glob(os.path.join(output_path, "part-*.parquet")):
+            os.remove(path)
+        n_rows = len(f[columns[0]])
+        rows_per_file = rows_per_file or max(n_rows, 1)
+        schema = pa.table({key: to_arrow_array(f[key][0:0]) for key in columns}).schema
+        # 0 行の場合も、スキーマだけを持つファイルを 1 つ書き込む
+        file_starts = range(0, n_rows, rows_per_file) or [0]
+        for file_index, file_start in enumerate(file_starts):
+            file_stop = min(file_start + rows_per_file, n_rows)
+            with pq.ParquetWriter(os.path.join(output_path, f"part-{file_index:05d}.parquet"), schema,
+                                  compression=compression, write_statistics=True) as writer:
+                for start in range(file_start, file_stop, row_group_rows):
+                    stop = min(start + row_group_rows, file_stop)
+                    table = pa.table({key: to_arrow_array(f[key][start:stop]) for key in columns})
+                    writer.write_table(table, row_group_size=row_group_rows)
+    return n_rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="CEERS 形式の HDF5 カタログを Parquet データセットに変換する")
+    parser.add_argument("data", help="入力の HDF5 ファイル")
+    parser.add_argument("output", help="出力先のディレクトリ")
+    parser.add_argument("--columns", default=None,
+                        help="変換する列名 (カンマ区切り)。省略時は変換できる列を全て変換する")
+    parser.add_argument("--row-group-rows", type=int, default=131072, help="1 行グループの行数")
+    parser.add_argument("--rows-per-file", type=int, default=None, help="1 ファイルあたりの行数")
+    parser.add_argument("--compression", default="zstd", help="Parquet の圧縮方式")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    columns = args.columns.split(",") if args.columns else None
+    n_rows = convert(args.data, args.output, columns, args.row_group_rows, args.rows_per_file, args.compression)
+    print(f"Converted {n_rows} rows to {args.output} in {time.time() - start_time:.2f} s")
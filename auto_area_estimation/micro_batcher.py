@@ -0,0 +1,170 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+# バックグラウンドスレッドに停止を伝えるための番兵
+_STOP = object()
+
+# fork 後にスレッドを作り直す処理の排他制御
+_restart_lock = threading.Lock()
+
+
+class _PendingRequest:
+    def __init__(self, X):
+        self.X = X
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class MicroBatcher:
+    def __init__(self, predict_fn, max_wait_ms=2.0, max_rows=4096):
+        """
+        同時に届いた推論リクエストを 1 つの行列にまとめて推論するマイクロバッチャー。
+
+        最初のリクエストが届いてから max_wait_ms 経過するか、行数が max_rows に達するまで
+        後続のリクエストを待ち、まとめて predict_fn を 1 回だけ呼び出して結果を各リクエストに振り分ける。
+
+        Args:
+            predict_fn (callable): 形状 (n_rows, n_features) の行列を受け取り、形状 (n_rows,) の予測値を返す関数。
+            max_wait_ms (float): バッチを締め切るまでの最大待ち時間 (ミリ秒)。
+            max_rows (int): 1 バッチの最大行数。これを超える単独のリクエストはそのまま 1 バッチとして処理する。
+        """
+        self.predict_fn = predict_fn
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_rows = max_rows
+        self._start()
+
+    def _start(self):
+        """キューとバックグラウンドスレッドを (プロセスごとに) 作成する。"""
+        self._pid = os.getpid()
+        self._queue = queue.Queue()
+        self._carry = None  # 行数の上限を超えたため次のバッチに回すリクエスト
+        self._closed = False
+        self._submit_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "batches": 0,
+            "requests": 0,
+            "rows": 0,
+            "max_batch_rows": 0,
+            "queue_wait_seconds_total": 0.0,
+            "max_queue_wait_seconds": 0.0,
+        }
+        self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, X):
+        """
+        推論リクエストをキューに追加する。
+
+        Args:
+            X (np.ndarray): 形状 (n_rows, n_features) の特徴量行列。
+
+        Returns:
+            Future: 形状 (n_rows,) の予測値が設定される Future。
+        """
+        # fork 後の子プロセスにはスレッドが引き継がれないため、作り直す
+        if self._pid != os.getpid():
+            with _restart_lock:
+                if self._pid != os.getpid():
+                    self._start()
+        pending = _PendingRequest(X)
+        with self._submit_lock:
+            if not self._closed:
+                self._queue.put(pending)
+                return pending.future
+
+        # close() 後に届いたリクエスト (モデルの差し替え直後など) はバッチングせずにその場で推論する
+        try:
+            pending.future.set_result(self.predict_fn(X))
+        except Exception as e:
+            pending.future.set_exception(e)
+        return pending.future
+
+    def predict(self, X):
+        """submit() した結果を待って返す。predict_fn と同じ呼び出し方で使える。"""
+        return self.submit(X).result()
+
+    def close(self):
+        """
+        バックグラウンドスレッドを停止する。キューに残っているリクエストは処理してから停止し、
+        以降に submit() されたリクエストは呼び出し元のスレッドで直接推論する。
+        """
+        with self._submit_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        if self._pid == os.getpid():
+            self._thread.join()
+
+    def stats(self):
+        """
+        バッチサイズとキュー待ち時間の統計を返す。
+
+        Returns:
+            dict: 処理したバッチ数・リクエスト数・行数と、その平均・最大値。
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        batches = max(stats["batches"], 1)
+        requests = max(stats["requests"], 1)
+        stats["mean_batch_rows"] = stats["rows"] / batches
+        stats["mean_batch_requests"] = stats["requests"] / batches
+        stats["mean_queue_wait_seconds"] = stats["queue_wait_seconds_total"] / requests
+        return stats
+
+    def _next_batch(self):
+        """キューからバッチを 1 つ取り出す。停止要求を受け取った場合は None を返す。"""
+        first = self._carry if self._carry is not None else self._queue.get()
+        self._carry = None
+        if first is _STOP:
+            return None
+
+        batch = [first]
+        rows = len(first.X)
+        deadline = first.enqueued_at + self.max_wait
+        while rows < self.max_rows:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                pending = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if pending is _STOP or rows + len(pending.X) > self.max_rows:
+                self._carry = pending
+                break
+            batch.append(pending)
+            rows += len(pending.X)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+
+            started_at = time.monotonic()
+            waits = [started_at - pending.enqueued_at for pending in batch]
+            sizes = [len(pending.X) for pending in batch]
+            try:
+                X = batch[0].X if len(batch) == 1 else np.concatenate([pending.X for pending in batch])
+                predictions = self.predict_fn(X)
+                for pending, result in zip(batch, np.split(predictions, np.cumsum(sizes)[:-1])):
+                    pending.future.set_result(result)
+            except Exception as e:
+                for pending in batch:
+                    pending.future.set_exception(e)
+
+            with self._stats_lock:
+                self._stats["batches"] += 1
+                self._stats["requests"] += len(batch)
+                self._stats["rows"] += sum(sizes)
+                self._stats["max_batch_rows"] = max(self._stats["max_batch_rows"], sum(sizes))
+                self._stats["queue_wait_seconds_total"] += sum(waits)
+                self._stats["max_queue_wait_seconds"] = max(self._stats["max_queue_wait_seconds"], max(waits))
@@ -0,0 +1,321 @@
+import argparse
+import datetime
+
+import h5py
+import numpy as np
+import torch
+import torch.nn as nn
+
+# モデルバンドルのファイル形式のバージョン (保存する辞書の構造を変えたら上げる)
+BUNDLE_FORMAT_VERSION = 1
+
+# 特徴量として使用する列名 (学習時と同じである必要があります)
+DEFAULT_FEATURES = [
+    'x2_image',
+    'y2_image',
+    'cxx_image',
+    'cyy_image',
+    'fluxerr_auto',
+    'flux_radius',
+    'area_iso',
+    'xy_image',
+    'npix',
+    'flux_aper_1',
+]
+
+# ターゲット変数 (予測したい変数)
+TARGET = 'area_auto'
+
+
+# 線形回帰モデルの定義 (学習時と同じである必要があります)
+class LinearRegressionModel(nn.Module):
+    def __init__(self, input_dim, output_dim):
+        super(LinearRegressionModel, self).__init__()
+        self.linear = nn.Linear(input_dim, output_dim)
+
+    def forward(self, x):
+        return self.linear(x)
+
+
+class StandardizedLinearRegressionModel(LinearRegressionModel):
+    def __init__(self, input_dim, output_dim, scaler_mean, scaler_scale):
+        """
+        学習時のスケーラーによる標準化を前処理として組み込んだ線形回帰モデル。
+
+        (x - mean) / scale を x * inv_scale + shift の形に事前計算しておき、
+        forward では 1 回の積和演算 (addcmul) で標準化を行う。
+
+        Args:
+            input_dim (int): 入力特徴量の数。
+            output_dim (int): 出力の数。
+            scaler_mean (array-like): 学習時に fit したスケーラーの mean_。
+            scaler_scale (array-like): 学習時に fit したスケーラーの scale_。
+        """
+        super(StandardizedLinearRegressionModel, self).__init__(input_dim, output_dim)
+        mean = torch.as_tensor(np.asarray(scaler_mean, dtype=np.float64))
+        scale = torch.as_tensor(np.asarray(scaler_scale, dtype=np.float64))
+        self.register_buffer("inv_scale", (1.0 / scale).float())
+        self.register_buffer("shift", (-mean / scale).float())
+
+    def forward(self, x):
+        return self.linear(torch.addcmul(self.shift, x, self.inv_scale))
+
+
+class ModelBundle:
+    def __init__(self, state_dict, scaler_mean, scaler_scale, features, version, device=None):
+        """
+        学習済みの重み・スケーラーの統計量・特徴量の順序をまとめたモデルバンドル。
+
+        Args:
+            state_dict (dict): LinearRegressionModel の状態辞書。
+            scaler_mean (array-like): 学習時に fit したスケーラーの mean_。
+            scaler_scale (array-like): 学習時に fit したスケーラーの scale_。
+            features (list): 特徴量の列名 (モデルの入力順)。
+            version (str): モデルのバージョン。
+            device (torch.device, optional): 推論に使用するデバイス。デフォルトは CPU。
+        """
+        self.features = list(features)
+        self.version = str(version)
+        self.scaler_mean = np.asarray(scaler_mean, dtype=np.float64)
+        self.scaler_scale = np.asarray(scaler_scale, dtype=np.float64)
+        self.state_dict = {k: v.detach().cpu() for k, v in state_dict.items()}
+        self.device = device if device is not None else torch.device("cpu")
+
+        if self.scaler_mean.shape != (len(self.features),) or self.scaler_scale.shape != (len(self.features),):
+            raise ValueError("Scaler statistics must have one value per feature.")
+
+        self.model = StandardizedLinearRegressionModel(len(self.features), 1, self.scaler_mean, self.scaler_scale)
+        self.model.linear.load_state_dict({k.split("linear.", 1)[-1]: v for k, v in self.state_dict.items()})
+        self.model.eval()  # 推論モードに設定
+        self.model.to(self.device)
+
+    def predict(self, X):
+        """
+        標準化前の特徴量行列から予測値を計算する。
+
+        Args:
+            X (np.ndarray): 形状 (n_rows, n_features) の特徴量行列 (列順は self.features)。
+
+        Returns:
+            np.ndarray: 形状 (n_rows,) の予測値。
+        """
+        return self.to_numpy(self.forward_tensor(self.to_tensor(X)))
+
+    def to_tensor(self, X):
+        """特徴量行列を float32 のテンソルとして推論に使用するデバイスへ転送する。"""
+        # torch は読み取り専用の配列 (np.frombuffer の結果など) を共有できないため、その場合のみコピーする
+        return torch.from_numpy(np.require(X, dtype=np.float32, requirements=["C", "W"])).to(self.device)
+
+    def forward_tensor(self, input_tensor):
+        """デバイス上のテンソルに対して順伝播を行う。"""
+        with torch.no_grad():
+            return self.model(input_tensor)
+
+    def to_numpy(self, predictions):
+        """順伝播の結果を形状 (n_rows,) の NumPy 配列として取り出す。"""
+        return predictions.cpu().numpy().reshape(-1)
+
+    def save(self, path):
+        """
+        モデルバンドルをファイルに保存する。
+
+        Args:
+            path (str): 保存先のパス。
+        """
+        torch.save({
+            "format_version": BUNDLE_FORMAT_VERSION,
+            "version": self.version,
+            "features": self.features,
+            "state_dict": self.state_dict,
+            "scaler_mean": torch.from_numpy(self.scaler_mean),
+            "scaler_scale": torch.from_numpy(self.scaler_scale),
+        }, path)
+
+    @classmethod
+    def load(cls, path, device=None):
+        """
+        save() で保存したモデルバンドルを読み込む。
+
+        Args:
+            path (str): モデルバンドルのパス。
+            device (torch.device, optional): 推論に使用するデバイス。
+
+        Returns:
+            ModelBundle: 読み込んだモデルバンドル。
+        """
+        payload = torch.load(path, map_location="cpu")
+        if not isinstance(payload, dict) or "format_version" not in payload:
+            raise ValueError(f"{path} is not a model bundle (plain state_dict?).")
+        if payload["format_version"] > BUNDLE_FORMAT_VERSION:
+            raise ValueError(f"Unsupported model bundle format version: {payload['format_version']}")
+        return cls(
+            payload["state_dict"],
+            payload["scaler_mean"].numpy(),
+            payload["scaler_scale"].numpy(),
+            payload["features"],
+            payload["version"],
+            device=device,
+        )
+
+    def fuse(self):
+        """
+        スケーラーの標準化を線形層の重みとバイアスに畳み込んだ FusedLinearModel を作成する。
+
+        W ((x - mean) / scale) + b = (W / scale) x + (b - W (mean / scale)) を float64 で計算する。
+
+        Returns:
+            FusedLinearModel: 生の特徴量に直接適用できる線形モデル。
+        """
+        weight = self.state_dict["linear.weight"].double().numpy().reshape(-1)
+        bias = float(self.state_dict["linear.bias"].double().numpy().reshape(-1)[0])
+        fused_weight = weight / self.scaler_scale
+        fused_bias = bias - float(np.dot(fused_weight, self.scaler_mean))
+        return FusedLinearModel(fused_weight, fused_bias, self.features, self.version)
+
+
+class FusedLinearModel:
+    def __init__(self, weight, bias, features, version):
+        """
+        標準化を畳み込んだ線形モデル。推論は NumPy の内積 1 回で行い、torch に依存しない。
+
+        Args:
+            weight (array-like): 形状 (n_features,) の重み。
+            bias (float): バイアス。
+            features (list): 特徴量の列名 (モデルの入力順)。
+            version (str): モデルのバージョン。
+        """
+        self.weight = np.asarray(weight, dtype=np.float64)
+        self.bias = float(bias)
+        self.features = list(features)
+        self.version = str(version)
+
+    def predict(self, X):
+        """
+        標準化前の特徴量行列から予測値を計算する。
+
+        Args:
+            X (np.ndarray): 形状 (n_rows, n_features) の特徴量行列 (列順は self.features)。
+
+        Returns:
+            np.ndarray: 形状 (n_rows,) の予測値。
+        """
+        return np.asarray(X, dtype=np.float64) @ self.weight + self.bias
+
+    def save(self, path):
+        """
+        融合済みモデルを .npz ファイルに保存する。
+
+        Args:
+            path (str): 保存先のパス。
+        """
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                format_version=BUNDLE_FORMAT_VERSION,
+                weight=self.weight,
+                bias=self.bias,
+                features=np.array(self.features),
+                version=self.version,
+            )
+
+    @classmethod
+    def load(cls, path):
+        """
+        save() で保存した融合済みモデルを読み込む。
+
+        Args:
+            path (str): 融合済みモデルのパス。
+
+        Returns:
+            FusedLinearModel: 読み込んだモデル。
+        """
+        with np.load(path, allow_pickle=False) as payload:
+            if int(payload["format_version"]) > BUNDLE_FORMAT_VERSION:
+                raise ValueError(f"Unsupported model bundle format version: {int(payload['format_version'])}")
+            return cls(
+                payload["weight"],
+                float(payload["bias"]),
+                [str(f) for f in payload["features"]],
+                str(payload["version"]),
+            )
+
+
+def save_model_bundle(path, model, scaler, features, version=None):
+    """
+    学習済みモデルと fit 済みの StandardScaler をモデルバンドルとして保存する。
+
+    Args:
+        path (str): 保存先のパス。
+        model (nn.Module or dict): 学習済みの LinearRegressionModel またはその状態辞書。
+        scaler (StandardScaler): 学習データで fit したスケーラー。
+        features (list): 特徴量の列名 (モデルの入力順)。
+        version (str, optional): モデルのバージョン。省略時は保存時刻から生成する。
+
+    Returns:
+        ModelBundle: 保存したモデルバンドル。
+    """
+    state_dict = model.state_dict() if isinstance(model, nn.Module) else model
+    if version is None:
+        version = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    bundle = ModelBundle(state_dict, scaler.mean_, scaler.scale_, features, version)
+    bundle.save(path)
+    return bundle
+
+
+def fit_scaler_from_hdf5(data_path, features, target=TARGET, n_splits=5, random_state=42):
+    """
+    ceers_training.ipynb の交差検証と同じ手順で、最後のフォールドの学習データにスケーラーを fit する。
+
+    ノートブックは最後のフォールドで学習したモデルを保存しているため、
+    既存の best_linear_regression_model.pth と対になるスケーラーを再現できる。
+
+    Args:
+        data_path (str): CEERS の HDF5 ファイルのパス。
+        features (list): 特徴量の列名。
+        target (str): ターゲット変数の列名。
+        n_splits (int): 交差検証の分割数。
+        random_state (int): KFold の乱数シード。
+
+    Returns:
+        StandardScaler: fit 済みのスケーラー。
+    """
+    from sklearn.model_selection import KFold
+    from sklearn.preprocessing import StandardScaler
+
+    with h5py.File(data_path, "r") as f:
+        X = np.column_stack([f[key][:] for key in features])
+        y = f[target][:]
+
+    # 欠損値の処理 (ノートブックの df.dropna() と同じく、特徴量かターゲットに NaN を含む行を削除)
+    valid = ~np.isnan(X).any(axis=1) & ~np.isnan(y)
+    X = X[valid]
+
+    kf = KFold(n_splits=n_splits, shuffle=True, random_state=random_state)
+    train_index = None
+    for train_index, _ in kf.split(X):
+        pass
+
+    scaler = StandardScaler()
+    scaler.fit(X[train_index])
+    return scaler
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="学習済みの重みとスケーラーからモデルバンドルを作成する")
+    parser.add_argument("--weights", default="best_linear_regression_model.pth", help="LinearRegressionModel の状態辞書")
+    parser.add_argument("--output", default="area_model_bundle.pth", help="出力するモデルバンドルのパス")
+    parser.add_argument("--version", default=None, help="モデルのバージョン (省略時は作成時刻)")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--scaler", help="joblib で保存した fit 済みの StandardScaler")
+    source.add_argument("--data", help="スケーラーを学習時と同じ手順で再 fit する CEERS の HDF5 ファイル")
+    args = parser.parse_args()
+
+    if args.scaler:
+        import joblib
+        scaler = joblib.load(args.scaler)
+    else:
+        scaler = fit_scaler_from_hdf5(args.data, DEFAULT_FEATURES)
+
+    state_dict = torch.load(args.weights, map_location="cpu")
+    bundle = save_model_bundle(args.output, state_dict, scaler, DEFAULT_FEATURES, version=args.version)
+    print(f"Model bundle (version {bundle.version}) saved to {args.output}")
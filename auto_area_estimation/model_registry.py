@@ -0,0 +1,342 @@
+import glob
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from model_bundle import FusedLinearModel, ModelBundle
+
+
+class UnknownModelVersionError(KeyError):
+    """要求されたバージョンのモデルが登録されていない場合に送出される。"""
+
+
+class ModelEntry:
+    def __init__(self, predictor, runner=None, path=None, signature=None):
+        """
+        レジストリに登録された 1 バージョン分のモデル。
+
+        Args:
+            predictor: features・version・predict() を持つ推論器 (ModelBundle や FusedLinearModel)。
+            runner (optional): 推論に使うオブジェクト (MicroBatcher など)。省略時は predictor をそのまま使う。
+            path (str, optional): 読み込んだファイルのパス。
+            signature (tuple, optional): 変更検知に使うファイルの (mtime, size)。
+        """
+        self.predictor = predictor
+        self.runner = runner if runner is not None else predictor
+        self.path = path
+        self.signature = signature
+        self.features = predictor.features
+        self.version = predictor.version
+
+    def predict(self, X):
+        return self.runner.predict(X)
+
+    def close(self):
+        if self.runner is not self.predictor and hasattr(self.runner, "close"):
+            self.runner.close()
+
+
+class ModelRegistry:
+    def __init__(self, model_dir=None, device=None, fused=False, poll_interval=5.0,
+                 active_version=None, shadow_version=None, wrap=None):
+        """
+        複数バージョンのモデルを保持し、リクエストをバージョンごとに振り分けるモデルレジストリ。
+
+        model_dir を指定した場合は、ディレクトリ内のモデルバンドル (*.pth) と融合済みモデル (*.npz) を
+        バックグラウンドで監視し、追加・更新されたファイルを読み込んでから登録内容をまとめて差し替える。
+        推論中のリクエストは差し替え前のモデルでそのまま処理されるため、再起動せずにモデルを入れ替えられる。
+
+        Args:
+            model_dir (str, optional): 監視するディレクトリ。
+            device (torch.device, optional): モデルバンドルの推論に使用するデバイス。
+            fused (bool): True の場合、モデルバンドルを融合済みモデルに変換して登録する。
+            poll_interval (float): ディレクトリを確認する間隔 (秒)。
+            active_version (str, optional): バージョン指定の無いリクエストに使うバージョン。
+                省略時はシャドーバージョン以外で最も新しいファイルのバージョンを使う。
+            shadow_version (str, optional): アクティブなモデルへのリクエストを裏で同時に推論し、
+                結果を比較するだけの候補バージョン (シャドースコアリング)。
+            wrap (callable, optional): 推論器を受け取り、推論に使うオブジェクト (MicroBatcher など) を返す関数。
+        """
+        self.model_dir = model_dir
+        self.device = device
+        self.fused = fused
+        self.poll_interval = poll_interval
+        self.active_version = active_version
+        self.shadow_version = shadow_version
+        self.wrap = wrap
+
+        # 登録内容 (バージョンからエントリへの辞書と、既定のバージョン) は読み取り専用のタプルとして扱い、
+        # 更新時は新しいタプルに差し替える。読み出し側はロックを取らずに一貫した組み合わせを参照できる
+        self._state = ({}, None)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watcher = None
+        # 他のファイルと同じバージョンのため読み込まなかったファイル (パスから (signature, version) への辞書)
+        self._duplicates = {}
+
+        self._pid = os.getpid()
+        self._shadow_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shadow")
+        self._shadow_stats_lock = threading.Lock()
+        self._shadow_stats = {"requests": 0, "rows": 0, "skipped": 0, "errors": 0,
+                              "abs_diff_total": 0.0, "max_abs_diff": 0.0}
+
+    def register(self, predictor, path=None, signature=None):
+        """
+        推論器をレジストリに登録する (同じバージョンが登録済みの場合は置き換える)。
+
+        Args:
+            predictor: features・version・predict() を持つ推論器。
+            path (str, optional): 読み込んだファイルのパス。
+            signature (tuple, optional): ファイルの (mtime, size)。
+
+        Returns:
+            ModelEntry: 登録したエントリ。
+        """
+        runner = self.wrap(predictor) if self.wrap is not None else None
+        entry = ModelEntry(predictor, runner, path, signature)
+        with self._lock:
+            entries = dict(self._state[0])
+            replaced = entries.get(entry.version)
+            entries[entry.version] = entry
+            self._swap(entries)
+        if replaced is not None:
+            replaced.close()
+        return entry
+
+    def resolve(self, version=None):
+        """
+        リクエストに使うモデルを返す。
+
+        Args:
+            version (str, optional): 要求されたバージョン。省略時はアクティブなバージョン。
+
+        Returns:
+            ModelEntry: 推論に使うモデル。
+
+        Raises:
+            UnknownModelVersionError: 該当するモデルが無い場合。
+        """
+        self._ensure_process()
+        entries, default_version = self._state
+        version = version or self.active_version or default_version
+        try:
+            return entries[version]
+        except KeyError:
+            if version is None and entries:
+                raise UnknownModelVersionError(
+                    f"No active model (only the shadow model {self.shadow_version} is loaded)") from None
+            raise UnknownModelVersionError(f"Unknown model version: {version}") from None
+
+    def resolve_all(self):
+        """登録済みの全バージョンのモデルを、バージョンからエントリへの辞書で返す。"""
+        return dict(self._state[0])
+
+    def versions(self):
+        """登録済みのバージョンとアクティブ・シャドーのバージョンを返す。"""
+        entries, default_version = self._state
+        return {
+            "active": self.active_version or default_version,
+            "shadow": self.shadow_version,
+            "versions": {version: entry.path for version, entry in entries.items()},
+        }
+
+    def predict(self, entry, X):
+        """
+        モデルで推論し、アクティブなモデルへのリクエストであればシャドーモデルでも裏で推論する。
+
+        Args:
+            entry (ModelEntry): resolve() で取得したモデル。
+            X (np.ndarray): 形状 (n_rows, n_features) の特徴量行列。
+
+        Returns:
+            np.ndarray: 形状 (n_rows,) の予測値 (シャドーモデルの結果は返さない)。
+        """
+        predictions = entry.predict(X)
+        if not self.shadow_version:
+            return predictions
+
+        entries, default_version = self._state
+        shadow = entries.get(self.shadow_version)
+        if shadow is not None and shadow is not entry and entry.version == (self.active_version or default_version):
+            self._ensure_process()
+            self._shadow_executor.submit(self._score_shadow, shadow, entry, X, predictions)
+        return predictions
+
+    def shadow_stats(self):
+        """シャドースコアリングの件数と、アクティブなモデルとの予測値の差の統計を返す。"""
+        with self._shadow_stats_lock:
+            stats = dict(self._shadow_stats)
+        stats["mean_abs_diff"] = stats["abs_diff_total"] / max(stats["rows"], 1)
+        return stats
+
+    def _score_shadow(self, shadow, entry, X, predictions):
+        if shadow.features != entry.features:
+            with self._shadow_stats_lock:
+                self._shadow_stats["skipped"] += 1
+            return
+        try:
+            abs_diff = np.abs(shadow.predictor.predict(X) - predictions)
+        except Exception as e:
+            print(f"Shadow scoring with model {shadow.version} failed: {e}")
+            with self._shadow_stats_lock:
+                self._shadow_stats["errors"] += 1
+            return
+        with self._shadow_stats_lock:
+            self._shadow_stats["requests"] += 1
+            self._shadow_stats["rows"] += len(abs_diff)
+            self._shadow_stats["abs_diff_total"] += float(abs_diff.sum())
+            self._shadow_stats["max_abs_diff"] = max(self._shadow_stats["max_abs_diff"], float(abs_diff.max(initial=0.0)))
+
+    def _swap(self, entries):
+        """登録内容を新しい辞書に差し替える (呼び出し側で self._lock を取得していること)。"""
+        # シャドーモデルが既定のモデルになると、ライブのリクエストを処理したうえでシャドースコアリングも止まってしまう
+        candidates = [entry for entry in entries.values() if entry.version != self.shadow_version]
+        newest = max(candidates, key=lambda e: e.signature[0] if e.signature else 0.0, default=None)
+        self._state = (entries, newest.version if newest is not None else None)
+        if newest is None and entries and not self.active_version:
+            print(f"Warning: only the shadow model {self.shadow_version} is loaded; "
+                  f"requests without a model version will fail until another model is added")
+
+    def _ensure_process(self):
+        """fork 後の子プロセスでは、引き継がれないスレッド (シャドースコアリング・監視) を作り直す。"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._shadow_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shadow")
+            if self._watcher is not None:
+                self._watcher = threading.Thread(target=self._watch, name="model-registry", daemon=True)
+                self._watcher.start()
+
+    def _load(self, path):
+        if path.endswith(".npz"):
+            return FusedLinearModel.load(path)
+        bundle = ModelBundle.load(path, device=self.device)
+        return bundle.fuse() if self.fused else bundle
+
+    def scan(self):
+        """
+        ディレクトリを 1 度確認し、追加・更新されたモデルを読み込み、削除されたモデルを登録から外す。
+        """
+        paths = sorted(glob.glob(os.path.join(self.model_dir, "*.pth")) + glob.glob(os.path.join(self.model_dir, "*.npz")))
+        signatures = {}
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            signatures[path] = (stat.st_mtime, stat.st_size)
+
+        entries = self._state[0]
+        known = {entry.path: entry for entry in entries.values() if entry.path is not None}
+        removed = [entry for path, entry in known.items() if path not in signatures]
+        # 重複のため読み込まなかったファイルは、ファイルが変更されたか、採用したファイルが削除された場合に読み込み直す
+        removed_versions = {entry.version for entry in removed}
+        self._duplicates = {path: (signature, version) for path, (signature, version) in self._duplicates.items()
+                            if signatures.get(path) == signature and version not in removed_versions}
+        loaded = []
+        for path, signature in signatures.items():
+            if path in known and known[path].signature == signature:
+                continue
+            if path in self._duplicates:
+                continue
+            try:
+                predictor = self._load(path)
+                # 初回の推論のオーバーヘッドでリクエストが遅くならないよう、差し替え前に 1 度推論しておく
+                predictor.predict(np.zeros((1, len(predictor.features))))
+            except Exception as e:
+                print(f"Error loading the model from {path}: {e}")
+                continue
+            loaded.append((predictor, path, signature))
+
+        loaded = self._drop_duplicates(loaded, known, removed)
+        if not loaded and not removed:
+            return
+
+        new_entries = []
+        for predictor, path, signature in loaded:
+            runner = self.wrap(predictor) if self.wrap is not None else None
+            new_entries.append(ModelEntry(predictor, runner, path, signature))
+
+        with self._lock:
+            entries = dict(self._state[0])
+            replaced = []
+            for entry in removed:
+                if entries.get(entry.version) is entry:
+                    replaced.append(entries.pop(entry.version))
+            for entry in new_entries:
+                if entry.version in entries:
+                    replaced.append(entries[entry.version])
+                entries[entry.version] = entry
+            self._swap(entries)
+
+        for entry in new_entries:
+            print(f"Model (version {entry.version}) loaded from {entry.path}")
+        for entry in replaced:
+            entry.close()
+
+    def _drop_duplicates(self, loaded, known, removed):
+        """
+        同じバージョンのファイルが複数ある場合に 1 つだけを残す。
+
+        パスごとに登録を差し替えると、同じバージョンのファイルが監視のたびに交互に読み込まれてしまうため、
+        更新日時が最も新しいファイル (同じ場合はパスが後のもの) だけを登録し、残りは変更されるまで読み込まない。
+
+        Args:
+            loaded (list): 今回読み込んだ (推論器, パス, signature) のリスト。
+            known (dict): 登録済みのエントリ (パスからエントリへの辞書)。
+            removed (list): 削除されたファイルのエントリ。
+
+        Returns:
+            list: loaded のうち、登録するもの。
+        """
+        reloaded = {path for _, path, _ in loaded}
+        candidates = {}
+        for path, entry in known.items():
+            if entry not in removed and path not in reloaded:
+                candidates.setdefault(entry.version, []).append((entry.signature, path))
+        for predictor, path, signature in loaded:
+            candidates.setdefault(predictor.version, []).append((signature, path))
+
+        winners = {}
+        for version, files in candidates.items():
+            winner = max(files, key=lambda f: (f[0][0], f[1]))
+            winners[version] = winner[1]
+            for signature, path in files:
+                if path != winner[1]:
+                    print(f"Warning: {path} has the same model version ({version}) as {winner[1]}; ignoring it")
+                    self._duplicates[path] = (signature, version)
+        return [item for item in loaded if winners[item[0].version] == item[1]]
+
+    def start(self):
+        """
+        ディレクトリを 1 度読み込んだ後、バックグラウンドでの監視を開始する。
+
+        Raises:
+            RuntimeError: バージョンが指定されていないリクエストに使えるモデルが無い
+                (シャドーバージョンのモデルしか読み込めなかった) 場合。
+        """
+        self.scan()
+        entries, default_version = self._state
+        if entries and not (self.active_version or default_version):
+            raise RuntimeError(f"Only the shadow model {self.shadow_version} was found in {self.model_dir}; "
+                               f"add an active model or set the active version explicitly")
+        self._watcher = threading.Thread(target=self._watch, name="model-registry", daemon=True)
+        self._watcher.start()
+
+    def stop(self):
+        """バックグラウンドでの監視を停止する。"""
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join()
+
+    def _watch(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.scan()
+            except Exception as e:
+                print(f"Error scanning {self.model_dir}: {e}")
@@ -1,124 +1,533 @@
+import argparse
+import io
+import json
+import os
+
 import torch
-import torch.nn as nn
-from flask import Flask, request, jsonify
-import pandas as pd
+from flask import Flask, Response, request, jsonify, stream_with_context
 import numpy as np
 from sklearn.preprocessing import StandardScaler
-import joblib  # モデルと一緒に scaler を保存・ロードするために使用
+
+from micro_batcher import MicroBatcher
+from model_bundle import DEFAULT_FEATURES, FusedLinearModel, LinearRegressionModel, ModelBundle
+from model_registry import ModelRegistry, UnknownModelVersionError
+from prediction_cache import PredictionCache
+import serve_metrics
+from serve_metrics import STAGE_SECONDS, InstrumentedPredictor, SamplingProfiler
 
 # デバイスの設定 (推論時は GPU が利用可能であれば利用する)
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 print(f"Using device: {device}")
 
-# 特徴量として使用する列名 (学習時と同じである必要があります)
-features = [
-    'x2_image',
-    'y2_image',
-    'cxx_image',
-    'cyy_image',
-    'fluxerr_auto',
-    'flux_radius',
-    'area_iso',
-    'xy_image',
-    'npix',
-    'flux_aper_1',
-]
-
-
-# 線形回帰モデルの定義 (学習時と同じである必要があります)
-class LinearRegressionModel(nn.Module):
-    def __init__(self, input_dim, output_dim):
-        super(LinearRegressionModel, self).__init__()
-        self.linear = nn.Linear(input_dim, output_dim)
-
-    def forward(self, x):
-        return self.linear(x)
+class LegacyPredictor:
+    def __init__(self, model):
+        """
+        スケーラーを含まない旧形式の状態辞書 (best_linear_regression_model.pth) 用の推論器。
+
+        学習時のスケーラーが無いため、リクエストごとに入力データで StandardScaler を fit する。
+        1 行だけのリクエストでは分散が 0 になり正しく予測できないため、モデルバンドルへの移行を推奨する。
+
+        Args:
+            model (LinearRegressionModel): 学習済みのモデル。
+        """
+        self.model = model
+        self.features = list(DEFAULT_FEATURES)
+        self.version = "legacy"
+        # 予測値が同じリクエスト内の他の行に依存するため、行ごとのキャッシュは使えない
+        self.cacheable = False
+        # 同じ理由で、他のリクエストの行とまとめて推論する (マイクロバッチング) と結果が変わってしまう
+        self.batchable = False
+
+    def predict(self, X):
+        scaled_input_data = StandardScaler().fit_transform(X)
+        input_tensor = torch.tensor(scaled_input_data, dtype=torch.float32).to(device)
+        with torch.no_grad():
+            predictions = self.model(input_tensor)
+        return predictions.cpu().numpy().reshape(-1)
+
+
+# バイナリ形式のリクエストで、本文の列順を指定するヘッダー
+COLUMNS_HEADER = "X-Feature-Columns"
+
+BINARY_MIMETYPE = "application/octet-stream"
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+ARROW_STREAM_MIMETYPE = "application/vnd.apache.arrow.stream"
+
+# /predict/stream で NDJSON の行をまとめて推論する行数
+STREAM_CHUNK_ROWS = int(os.environ.get("STREAM_CHUNK_ROWS", "4096"))
+
+
+class InvalidRequestError(ValueError):
+    """リクエストの形式が不正な場合に送出される (HTTP 400 として返す)。"""
+
+
+class MissingFeaturesError(InvalidRequestError):
+    def __init__(self, missing_features):
+        super(MissingFeaturesError, self).__init__(f"Missing required features: {missing_features}")
+        self.missing_features = missing_features
+
+
+def load_predictor(bundle_path, legacy_model_path, fused=False):
+    """
+    推論器を読み込む。モデルバンドルがあればそれを、無ければ旧形式の状態辞書を使用する。
+
+    Args:
+        bundle_path (str): モデルバンドル (.pth) または融合済みモデル (.npz) のパス。
+        legacy_model_path (str): 旧形式の状態辞書のパス。
+        fused (bool): True の場合、モデルバンドルを融合済みモデルに変換して NumPy だけで推論する。
+
+    Returns:
+        ModelBundle or FusedLinearModel or LegacyPredictor or None: 読み込んだ推論器。読み込めなかった場合は None。
+    """
+    try:
+        if os.path.exists(bundle_path) and bundle_path.endswith(".npz"):
+            fused_model = FusedLinearModel.load(bundle_path)
+            print(f"Fused model (version {fused_model.version}) loaded successfully from {bundle_path}")
+            return fused_model
+
+        if os.path.exists(bundle_path):
+            bundle = ModelBundle.load(bundle_path, device=device)
+            print(f"Model bundle (version {bundle.version}) loaded successfully from {bundle_path}")
+            return bundle.fuse() if fused else bundle
+
+        # モデルの状態辞書をロード
+        state_dict = torch.load(legacy_model_path, map_location=device)
+        model = LinearRegressionModel(len(DEFAULT_FEATURES), 1)
+        model.load_state_dict(state_dict)
+        model.eval()  # 推論モードに設定
+        model.to(device)
+        print(f"Model loaded successfully from {legacy_model_path}")
+        print("Warning: model bundle not found, falling back to per-request standardization. "
+              "Create one with `python model_bundle.py`.")
+        return LegacyPredictor(model)
+    except FileNotFoundError:
+        print(f"Error: Model file not found at {legacy_model_path}")
+    except Exception as e:
+        print(f"Error loading the model: {e}")
+    return None
+
+
+def rows_to_matrix(rows, features):
+    """
+    辞書のリスト形式のリクエストデータを、pandas を経由せずに特徴量行列へ変換する。
+
+    Args:
+        rows (list): 各行の特徴量を持つ辞書のリスト。
+        features (list): 特徴量の列名 (モデルの入力順)。
+
+    Returns:
+        np.ndarray: 形状 (n_rows, n_features) の float64 の特徴量行列。
+
+    Raises:
+        InvalidRequestError: 辞書ではない行が含まれる場合。
+        MissingFeaturesError: どの行にも含まれない特徴量がある場合。
+    """
+    if not all(isinstance(row, dict) for row in rows):
+        raise InvalidRequestError("Invalid JSON data format. Expected a dictionary or a list of dictionaries.")
+    try:
+        return np.array([[row[f] for f in features] for row in rows], dtype=np.float64)
+    except KeyError:
+        # 一部の行にだけ含まれない特徴量は NaN として扱う (DataFrame を作った場合と同じ挙動)
+        present = set().union(*rows)
+        missing_features = [f for f in features if f not in present]
+        if missing_features:
+            raise MissingFeaturesError(missing_features)
+        return np.array([[row.get(f, np.nan) for f in features] for row in rows], dtype=np.float64)
+
+
+def columns_to_matrix(columns, features):
+    """
+    列指向の JSON ({"x2_image": [...], "y2_image": [...], ...}) を特徴量行列へ変換する。
+
+    Args:
+        columns (dict): 列名から値のリストへの辞書。
+        features (list): 特徴量の列名 (モデルの入力順)。
+
+    Returns:
+        np.ndarray: 形状 (n_rows, n_features) の float64 の特徴量行列。
+
+    Raises:
+        MissingFeaturesError: 必要な列が含まれない場合。
+        InvalidRequestError: 列の長さが揃っていない場合。
+    """
+    missing_features = [f for f in features if f not in columns]
+    if missing_features:
+        raise MissingFeaturesError(missing_features)
+    arrays = [np.asarray(columns[f], dtype=np.float64).reshape(-1) for f in features]
+    if len({len(a) for a in arrays}) > 1:
+        raise InvalidRequestError("All feature columns must have the same length.")
+    return np.column_stack(arrays)
+
+
+def json_to_matrix(data, features):
+    """
+    /predict の JSON リクエストを特徴量行列へ変換する。
+
+    1 行分の辞書、辞書のリスト、列指向の辞書 (値がリスト) のいずれかを受け付ける。
+
+    Args:
+        data (dict or list): デコード済みの JSON。
+        features (list): 特徴量の列名 (モデルの入力順)。
+
+    Returns:
+        np.ndarray: 形状 (n_rows, n_features) の float64 の特徴量行列。
+
+    Raises:
+        InvalidRequestError: リクエストの形式が不正な場合。
+    """
+    if not data:
+        raise InvalidRequestError("No JSON data provided")
+    if isinstance(data, dict):
+        if any(isinstance(v, list) for v in data.values()):
+            return columns_to_matrix(data, features)
+        return rows_to_matrix([data], features)
+    if isinstance(data, list):
+        return rows_to_matrix(data, features)
+    raise InvalidRequestError("Invalid JSON data format. Expected a dictionary or a list of dictionaries.")
+
+
+def binary_to_matrix(body, column_header, features):
+    """
+    リトルエンディアンの float32 の行列 (行優先) を、コピーせずに特徴量行列として読み込む。
+
+    Args:
+        body (bytes): リクエスト本文。
+        column_header (str): 本文の列順をカンマ区切りで指定したヘッダーの値。
+        features (list): 特徴量の列名 (モデルの入力順)。
+
+    Returns:
+        np.ndarray: 形状 (n_rows, n_features) の float32 の特徴量行列。
+
+    Raises:
+        InvalidRequestError: ヘッダーが無い場合や、本文の長さが列数と合わない場合。
+    """
+    if not column_header:
+        raise InvalidRequestError(f"Binary requests require the {COLUMNS_HEADER} header.")
+    columns = [c.strip() for c in column_header.split(",")]
+    missing_features = [f for f in features if f not in columns]
+    if missing_features:
+        raise MissingFeaturesError(missing_features)
+    if len(body) % (4 * len(columns)) != 0:
+        raise InvalidRequestError(
+            f"Body length {len(body)} is not a multiple of {len(columns)} float32 columns.")
+
+    matrix = np.frombuffer(body, dtype="<f4").reshape(-1, len(columns))
+    if columns == features:
+        return matrix
+    return matrix[:, [columns.index(f) for f in features]]
+
 
 # Flask アプリケーションの初期化
 app = Flask(__name__)
 
-# モデルのロード
+# リクエストで使用するモデルのバージョンを指定するヘッダー (レスポンスには実際に使ったバージョンを返す)
+MODEL_VERSION_HEADER = "X-Model-Version"
+
+# マイクロバッチング (MICRO_BATCH_WINDOW_MS > 0 の場合、同時に届いたリクエストをモデルごとにまとめて推論する)
+micro_batch_window_ms = float(os.environ.get("MICRO_BATCH_WINDOW_MS", "0"))
+micro_batch_max_rows = int(os.environ.get("MICRO_BATCH_MAX_ROWS", "4096"))
+
+
+def _wrap_predictor(predictor):
+    # 推論の段階 (転送・順伝播) ごとの処理時間を記録し、マイクロバッチングが有効ならその内側で推論する
+    # (予測値が行ごとに独立していない推論器 (batchable = False) はリクエストごとに推論する)
+    instrumented = InstrumentedPredictor(predictor)
+    if micro_batch_window_ms <= 0:
+        return instrumented
+    if not getattr(predictor, "batchable", True):
+        print(f"Warning: micro-batching disabled for model {predictor.version} "
+              "(its predictions depend on the other rows of the request)")
+        return instrumented
+    return MicroBatcher(instrumented.predict, max_wait_ms=micro_batch_window_ms, max_rows=micro_batch_max_rows)
+
+
+# モデルのロード (起動時に 1 度だけ行う)
+# MODEL_FUSED=1 の場合はスケーラーを重みに畳み込み、リクエスト処理で torch を使わない
+# MODEL_DIR を指定した場合は、ディレクトリ内のモデルを監視して追加・更新を無停止で反映する
+fused_mode = os.environ.get("MODEL_FUSED") == "1"
+model_dir = os.environ.get("MODEL_DIR")
+registry = ModelRegistry(
+    model_dir=model_dir,
+    device=device,
+    fused=fused_mode,
+    poll_interval=float(os.environ.get("MODEL_POLL_INTERVAL", "5")),
+    active_version=os.environ.get("MODEL_ACTIVE_VERSION"),
+    shadow_version=os.environ.get("MODEL_SHADOW_VERSION"),
+    wrap=_wrap_predictor,
+)
+bundle_path = os.environ.get("MODEL_BUNDLE_PATH", "area_model_bundle.pth")
 model_path = "best_linear_regression_model.pth"
-loaded_model = None
-try:
-    # モデルの状態辞書をロード
-    state_dict = torch.load(model_path, map_location=device)
-
-    # モデルの入力次元数を特定 (特徴量の数)
-    input_dim = len(features)
-    output_dim = 1
-    loaded_model = LinearRegressionModel(input_dim, output_dim)
-    loaded_model.load_state_dict(state_dict)
-    loaded_model.eval()  # 推論モードに設定
-    loaded_model.to(device)
-    print(f"Model loaded successfully from {model_path}")
-except FileNotFoundError:
-    print(f"Error: Model file not found at {model_path}")
-    loaded_model = None
-except Exception as e:
-    print(f"Error loading the model: {e}")
-    loaded_model = None
-
-# 標準化のためのスケーラー (学習時に使用したスケーラーを保存していればロードする)
-# 今回の学習スクリプトではスケーラーを保存していないため、
-# 推論リクエストごとにデータを標準化するロジックをここに記述する必要があります。
-# 注意: 本番環境では、学習済みのスケーラーを保存してロードすることを強く推奨します。
-# 例: joblib.load('scaler.pkl')
+if model_dir:
+    registry.start()
+else:
+    loaded_model = load_predictor(bundle_path, model_path, fused=fused_mode)
+    if loaded_model is not None:
+        registry.register(loaded_model)
+if micro_batch_window_ms > 0:
+    print(f"Micro-batching enabled (window {micro_batch_window_ms} ms, max {micro_batch_max_rows} rows)")
+
+# 予測値のキャッシュ (PREDICTION_CACHE_SIZE > 0 の場合、同じ行の再送は推論せずにキャッシュから返す)
+prediction_cache_size = int(os.environ.get("PREDICTION_CACHE_SIZE", "0"))
+prediction_cache = None
+if prediction_cache_size > 0:
+    prediction_cache_ttl = float(os.environ.get("PREDICTION_CACHE_TTL", "0")) or None
+    prediction_cache = PredictionCache(max_entries=prediction_cache_size, ttl_seconds=prediction_cache_ttl)
+    print(f"Prediction cache enabled (max {prediction_cache_size} rows, TTL {prediction_cache_ttl} s)")
+
+# サンプリングプロファイラ (PROFILE_SAMPLE_RATE > 0 の場合、その割合の /predict を cProfile で計測して PROFILE_DIR に保存する)
+profiler = SamplingProfiler(float(os.environ.get("PROFILE_SAMPLE_RATE", "0")), os.environ.get("PROFILE_DIR", "profiles"))
+
+
+def resolve_model(version=None):
+    """
+    リクエストに使うモデルを取得する。
+
+    Args:
+        version (str, optional): MODEL_VERSION_HEADER で指定されたバージョン。
+
+    Returns:
+        tuple: (ModelEntry, None) または、取得できなかった場合は (None, (ステータスコード, エラーメッセージ))。
+    """
+    try:
+        return registry.resolve(version), None
+    except UnknownModelVersionError as e:
+        if version:
+            return None, (404, e.args[0])
+        return None, (500, "Model not loaded")
+
+
+def run_prediction(model, input_data):
+    """
+    特徴量行列に対して推論を行う (シャドーモデルが設定されている場合は裏で比較用の推論も行う)。
+
+    予測値のキャッシュが有効な場合は、キャッシュに無い行だけを推論する。
+
+    Args:
+        model (ModelEntry): resolve_model() で取得したモデル。
+        input_data (np.ndarray): 形状 (n_rows, n_features) の特徴量行列 (列順は model.features)。
+
+    Returns:
+        np.ndarray: 形状 (n_rows,) の予測値。
+    """
+    if prediction_cache is None or not getattr(model.predictor, "cacheable", True):
+        return registry.predict(model, input_data)
+
+    keys = prediction_cache.keys(model.version, input_data)
+    predictions, missing = prediction_cache.lookup(keys)
+    if missing.any():
+        computed = registry.predict(model, input_data[missing])
+        predictions[missing] = computed
+        prediction_cache.store([key for key, m in zip(keys, missing) if m], computed)
+    return predictions
+
+
+def _predict_response():
+    model, error = resolve_model(request.headers.get(MODEL_VERSION_HEADER))
+    if error is not None:
+        return jsonify({"error": error[1]}), error[0]
+
+    try:
+        # 必要な特徴量が揃っているか確認し、特徴量の順序を学習時と同じにする
+        # (バイナリ形式は DataFrame や JSON のデコードを経由せず np.frombuffer で読み込む)
+        try:
+            if request.mimetype == BINARY_MIMETYPE:
+                with STAGE_SECONDS.time("parse"):
+                    body = request.get_data()
+                with STAGE_SECONDS.time("build"):
+                    input_data = binary_to_matrix(body, request.headers.get(COLUMNS_HEADER), model.features)
+            else:
+                with STAGE_SECONDS.time("parse"):
+                    data = request.get_json()
+                with STAGE_SECONDS.time("build"):
+                    input_data = json_to_matrix(data, model.features)
+        except InvalidRequestError as e:
+            return jsonify({"error": str(e)}), 400
+        serve_metrics.REQUEST_ROWS.observe(len(input_data), "predict")
+
+        # 標準化と推論の実行 (標準化は読み込み済みのスケーラーの統計量で行う)
+        predictions = run_prediction(model, input_data)
+
+        # Accept でバイナリが要求された場合は float32 の配列をそのまま返す
+        with STAGE_SECONDS.time("serialize"):
+            if request.accept_mimetypes.best == BINARY_MIMETYPE:
+                return predictions.astype("<f4").tobytes(), 200, {"Content-Type": BINARY_MIMETYPE,
+                                                                  MODEL_VERSION_HEADER: model.version}
+            return jsonify({"predicted_area_auto": predictions.tolist()}), 200, {MODEL_VERSION_HEADER: model.version}
+
+    except Exception as e:
+        return jsonify({"error": f"Prediction error: {e}"}), 500
+
 
 @app.route('/predict', methods=['POST'])
 def predict():
-    if loaded_model is None:
-        return jsonify({"error": "Model not loaded"}), 500
+    with profiler.maybe_profile("predict"), serve_metrics.REQUEST_SECONDS.time("predict"):
+        response = app.make_response(_predict_response())
+    serve_metrics.REQUESTS_TOTAL.inc("predict", str(response.status_code))
+    return response
+
+
+def _predict_ndjson_stream(model, stream):
+    """
+    NDJSON (1 行 1 レコードの JSON) を STREAM_CHUNK_ROWS 行ずつ推論し、チャンクごとの結果を NDJSON で返す。
+    """
+    rows = []
+    for line in stream:
+        if not line.strip():
+            continue
+        rows.append(json.loads(line))
+        if len(rows) >= STREAM_CHUNK_ROWS:
+            yield json.dumps({"predicted_area_auto": run_prediction(model, rows_to_matrix(rows, model.features)).tolist()}) + "\n"
+            rows = []
+    if rows:
+        yield json.dumps({"predicted_area_auto": run_prediction(model, rows_to_matrix(rows, model.features)).tolist()}) + "\n"
+
+
+def _predict_arrow_stream(model, stream):
+    """
+    Arrow IPC ストリームのレコードバッチごとに推論し、予測値のレコードバッチを Arrow IPC ストリームで返す。
+    """
+    import pyarrow as pa
 
+    reader = pa.ipc.open_stream(stream)
+    missing_features = [f for f in model.features if f not in reader.schema.names]
+    if missing_features:
+        raise MissingFeaturesError(missing_features)
+
+    sink = io.BytesIO()
+    writer = pa.ipc.new_stream(sink, pa.schema([("predicted_area_auto", pa.float32())]))
+    for batch in reader:
+        input_data = np.column_stack([batch.column(f).to_numpy(zero_copy_only=False) for f in model.features])
+        predictions = run_prediction(model, input_data).astype(np.float32)
+        writer.write_batch(pa.record_batch([pa.array(predictions)], names=["predicted_area_auto"]))
+        yield sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+    writer.close()
+    yield sink.getvalue()
+
+
+def open_prediction_stream(model, content_type, stream):
+    """
+    /predict/stream の本文を読み込みながらチャンクごとに推論するイテレーターを作成する (Flask 版と ASGI 版で共通)。
+
+    Args:
+        model (ModelEntry): resolve_model() で取得したモデル。
+        content_type (str): リクエストの Content-Type (パラメーターを除く)。
+        stream (file-like): リクエスト本文を読み込むバイナリのファイルオブジェクト。
+
+    Returns:
+        tuple: (レスポンス本文のチャンクのイテレーター, レスポンスの Content-Type)。
+            最初のチャンクを取り出す際の InvalidRequestError は 400、それ以外の例外は 500 として返すこと。
+    """
+    if content_type == ARROW_STREAM_MIMETYPE:
+        return _predict_arrow_stream(model, stream), ARROW_STREAM_MIMETYPE
+    return _predict_ndjson_stream(model, stream), NDJSON_MIMETYPE
+
+
+def guard_prediction_stream(chunks, mimetype):
+    """
+    レスポンスの送信開始後に発生したエラーを処理しながらチャンクを返す。
+
+    送信開始後はステータスコードを変えられないため、NDJSON の場合はエラー行を返して終了する
+    (Arrow IPC ストリームの場合は例外をそのまま送出し、接続を切る)。
+    """
     try:
-        data = request.get_json()
-        if not data:
-            return jsonify({"error": "No JSON data provided"}), 400
-
-        # リクエストデータが辞書のリスト形式であることを想定
-        if isinstance(data, dict):
-            input_df = pd.DataFrame([data])
-        elif isinstance(data, list):
-            input_df = pd.DataFrame(data)
-        else:
-            return jsonify({"error": "Invalid JSON data format. Expected a dictionary or a list of dictionaries."}), 400
-
-        # 必要な特徴量がすべて揃っているか確認
-        if not all(feature in input_df.columns for feature in features):
-            missing_features = [f for f in features if f not in input_df.columns]
-            return jsonify({"error": f"Missing required features: {missing_features}"}), 400
-
-        # 特徴量の順序を学習時と同じにする
-        input_data = input_df[features].values
-
-        # 標準化 (学習時と同じように行う)
-        # 注意: ここでは、学習データ全体で fit された scaler を使用する必要があります。
-        #       理想的には、この scaler をファイルに保存してロードします。
-        #       ここでは、推論ごとに簡易的な標準化を行う例を示します。
-        scaler = StandardScaler()
-        # 推論データのみで fit_transform すると、学習時とスケールが異なる可能性があります。
-        # 本番環境では、学習済みの scaler をロードして transform のみを行うべきです。
-        # ここでは、デモンストレーションとして、簡易的に標準化を行います。
-        # 実際には、学習時に fit した scaler を保存し、ここで load して使用してください。
-        # 例: loaded_scaler = joblib.load('scaler.pkl')
-        #    scaled_input_data = loaded_scaler.transform(input_data)
-        scaled_input_data = scaler.fit_transform(input_data) # デモ用
-
-        # PyTorch Tensor に変換し、適切なデバイスに移動
-        input_tensor = torch.tensor(scaled_input_data, dtype=torch.float32).to(device)
+        yield from chunks
+    except Exception as e:
+        if mimetype != NDJSON_MIMETYPE:
+            raise
+        yield json.dumps({"error": f"Prediction error: {e}"}) + "\n"
 
-        # 推論の実行
-        with torch.no_grad():
-            predictions = loaded_model(input_tensor)
 
-        # 結果を NumPy 配列に変換し、リスト形式にする
-        predicted_areas = predictions.cpu().numpy().flatten().tolist()
+@app.route('/predict/stream', methods=['POST'])
+def predict_stream():
+    """
+    カタログ全体のような大量の行を、リクエスト全体をメモリに載せずにチャンクごとに推論して返す。
+
+    Content-Type が application/vnd.apache.arrow.stream の場合は Arrow IPC ストリーム、
+    それ以外は NDJSON として扱い、同じ形式で結果をストリーミングする。
+    """
+    model, error = resolve_model(request.headers.get(MODEL_VERSION_HEADER))
+    if error is not None:
+        return jsonify({"error": error[1]}), error[0]
 
-        return jsonify({"predicted_area_auto": predicted_areas})
+    chunks, mimetype = open_prediction_stream(model, request.mimetype, request.stream)
 
+    # 最初のチャンクまでに検出できるエラー (列の不足など) は通常のエラーレスポンスとして返す
+    try:
+        first_chunk = next(chunks, None)
+    except InvalidRequestError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": f"Prediction error: {e}"}), 500
 
+    def generate():
+        if first_chunk is not None:
+            yield first_chunk
+        yield from guard_prediction_stream(chunks, mimetype)
+
+    return Response(stream_with_context(generate()), mimetype=mimetype, headers={MODEL_VERSION_HEADER: model.version})
+
+
+def serving_stats():
+    """モデルごとのマイクロバッチングの統計と、シャドースコアリング・予測値のキャッシュの統計を返す。"""
+    entries = registry.resolve_all()
+    return {
+        "micro_batching": {version: entry.runner.stats() for version, entry in entries.items()
+                           if isinstance(entry.runner, MicroBatcher)} or None,
+        "shadow": registry.shadow_stats() if registry.shadow_version else None,
+        "cache": prediction_cache.stats() if prediction_cache is not None else None,
+    }
+
+
+def metrics_text():
+    """/predict の段階別の処理時間・行数のヒストグラムと、serving_stats() の数値を Prometheus のテキスト形式で返す。"""
+    entries = registry.resolve_all()
+    gauges = [serve_metrics.render_gauges("area_model_microbatch", [
+        ((("version", version),), entry.runner.stats()) for version, entry in entries.items()
+        if isinstance(entry.runner, MicroBatcher)])]
+    if registry.shadow_version:
+        gauges.append(serve_metrics.render_gauges("area_model_shadow", [((), registry.shadow_stats())]))
+    if prediction_cache is not None:
+        gauges.append(serve_metrics.render_gauges("area_model_cache", [((), prediction_cache.stats())]))
+    return serve_metrics.render(*gauges)
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus 形式のメトリクスを返す。"""
+    return Response(metrics_text(), content_type=serve_metrics.CONTENT_TYPE)
+
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    """マイクロバッチング・シャドースコアリング・予測値のキャッシュの統計を返す。"""
+    return jsonify(serving_stats())
+
+
+@app.route('/models', methods=['GET'])
+def models():
+    """登録済みのモデルのバージョンと、アクティブ・シャドーのバージョンを返す。"""
+    return jsonify(registry.versions())
+
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=8085)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="面積推定モデルの推論サーバー")
+    parser.add_argument("--export-fused", metavar="PATH",
+                        help="モデルバンドルを融合済みモデル (.npz) として書き出して終了する")
+    args = parser.parse_args()
+
+    if args.export_fused:
+        # MODEL_FUSED の設定に関わらず、融合前のモデルバンドルをファイルから直接読み込む
+        if not os.path.exists(bundle_path) or bundle_path.endswith(".npz"):
+            raise SystemExit(f"Error: a model bundle is required to export a fused model (MODEL_BUNDLE_PATH={bundle_path})")
+        try:
+            bundle = ModelBundle.load(bundle_path, device=device)
+        except Exception as e:
+            raise SystemExit(f"Error loading the model bundle from {bundle_path}: {e}")
+        bundle.fuse().save(args.export_fused)
+        print(f"Fused model saved to {args.export_fused}")
+    else:
+        app.run(debug=True, host='0.0.0.0', port=8085)
@@ -0,0 +1,97 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class PredictionCache:
+    def __init__(self, max_entries=100000, ttl_seconds=None):
+        """
+        特徴量ベクトルごとの予測値を保持する LRU キャッシュ (任意で TTL 付き)。
+
+        キーはモデルのバージョンと、float32 に量子化した特徴量ベクトル (モデルの入力順) のバイト列で、
+        同じ行が再送された場合は推論せずに保持している予測値を返す。
+
+        Args:
+            max_entries (int): 保持する行数の上限。超えた場合は最も長く使われていない行から削除する。
+            ttl_seconds (float, optional): 予測値を保持する秒数。省略時は期限なし。
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # (version, row bytes) -> (予測値, 有効期限)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    @staticmethod
+    def keys(version, X):
+        """
+        特徴量行列の各行のキャッシュキーを作成する。
+
+        Args:
+            version (str): モデルのバージョン。
+            X (np.ndarray): 形状 (n_rows, n_features) の特徴量行列。
+
+        Returns:
+            list: 各行のキー。
+        """
+        quantized = np.ascontiguousarray(X, dtype="<f4")
+        row_bytes = quantized.shape[1] * quantized.itemsize
+        buffer = quantized.tobytes()
+        return [(version, buffer[i:i + row_bytes]) for i in range(0, len(buffer), row_bytes)]
+
+    def lookup(self, keys):
+        """
+        キャッシュから予測値を取得する。
+
+        Args:
+            keys (list): keys() で作成したキー。
+
+        Returns:
+            tuple: (予測値の配列 (キャッシュに無い行は NaN), キャッシュに無い行のマスク)。
+        """
+        predictions = np.full(len(keys), np.nan)
+        missing = np.ones(len(keys), dtype=bool)
+        now = time.monotonic()
+        with self._lock:
+            for i, key in enumerate(keys):
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                if entry[1] is not None and entry[1] < now:
+                    del self._entries[key]
+                    self._stats["expirations"] += 1
+                    continue
+                self._entries.move_to_end(key)
+                predictions[i] = entry[0]
+                missing[i] = False
+            hits = len(keys) - int(missing.sum())
+            self._stats["hits"] += hits
+            self._stats["misses"] += len(keys) - hits
+        return predictions, missing
+
+    def store(self, keys, predictions):
+        """
+        予測値をキャッシュに追加する。
+
+        Args:
+            keys (list): keys() で作成したキー。
+            predictions (np.ndarray): 各キーに対応する予測値。
+        """
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds else None
+        with self._lock:
+            for key, value in zip(keys, predictions.tolist()):
+                self._entries[key] = (value, expires_at)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def stats(self):
+        """ヒット・ミス・削除の件数と、保持している行数を返す。"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        stats["max_entries"] = self.max_entries
+        stats["hit_ratio"] = stats["hits"] / max(stats["hits"] + stats["misses"], 1)
+        return stats
@@ -0,0 +1,217 @@
+import bisect
+import cProfile
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# Prometheus のテキスト形式の Content-Type
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 処理時間 (秒) のヒストグラムのバケット
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# 1 リクエストあたりの行数のヒストグラムのバケット
+ROW_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096, 16384, 65536, 262144)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+class Histogram:
+    def __init__(self, name, documentation, buckets, labelnames=()):
+        """
+        Prometheus 形式のヒストグラム。
+
+        Args:
+            name (str): メトリクス名。
+            documentation (str): HELP に出力する説明。
+            buckets (tuple): バケットの上限値 (昇順)。+Inf は自動で追加される。
+            labelnames (tuple): ラベル名。
+        """
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.labelnames = tuple(labelnames)
+        self._series = {}  # ラベル値のタプル -> [バケットごとの件数, 合計, 件数]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        """値を 1 件記録する。labelvalues は labelnames と同じ順序で指定する。"""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *labelvalues):
+        """with ブロックの処理時間 (秒) を記録する。"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labelvalues)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: (list(counts), total, count) for labels, (counts, total, count) in self._series.items()}
+        for labelvalues, (counts, total, count) in sorted(series.items()):
+            labels = list(zip(self.labelnames, labelvalues))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        """
+        Prometheus 形式のカウンター。
+
+        Args:
+            name (str): メトリクス名。
+            documentation (str): HELP に出力する説明。
+            labelnames (tuple): ラベル名。
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for labelvalues, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(list(zip(self.labelnames, labelvalues)))} {value}")
+        return "\n".join(lines)
+
+
+def render_gauges(prefix, series):
+    """
+    統計の辞書 (MicroBatcher.stats() など) の数値をゲージとして出力する。
+
+    Args:
+        prefix (str): メトリクス名の接頭辞。
+        series (list): (ラベルの (名前, 値) のタプル, 名前から数値への辞書) のリスト。
+
+    Returns:
+        str: Prometheus のテキスト形式。
+    """
+    samples = {}
+    for labels, stats in series:
+        for key, value in stats.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                samples.setdefault(f"{prefix}_{key}", []).append(f"{_format_labels(list(labels))} {value}")
+    lines = []
+    for name, values in sorted(samples.items()):
+        lines.append(f"# TYPE {name} gauge")
+        lines.extend(name + value for value in values)
+    return "\n".join(lines)
+
+
+# /predict の処理段階ごとの処理時間
+STAGE_SECONDS = Histogram(
+    "area_model_predict_stage_seconds",
+    "Time spent in each stage of /predict (parse, build, transfer, forward, fetch, serialize).",
+    LATENCY_BUCKETS, labelnames=("stage",))
+
+# /predict 全体の処理時間
+REQUEST_SECONDS = Histogram(
+    "area_model_request_seconds", "End-to-end /predict latency.", LATENCY_BUCKETS, labelnames=("endpoint",))
+
+# 1 リクエストあたりの行数
+REQUEST_ROWS = Histogram(
+    "area_model_request_rows", "Number of rows per /predict request.", ROW_BUCKETS, labelnames=("endpoint",))
+
+# ステータスコードごとのリクエスト数と、推論した行数
+REQUESTS_TOTAL = Counter("area_model_requests_total", "Number of /predict requests.", labelnames=("endpoint", "status"))
+ROWS_TOTAL = Counter("area_model_rows_total", "Number of rows scored.", labelnames=("version",))
+
+METRICS = (STAGE_SECONDS, REQUEST_SECONDS, REQUEST_ROWS, REQUESTS_TOTAL, ROWS_TOTAL)
+
+
+def render(*extra):
+    """全メトリクスを Prometheus のテキスト形式で出力する。extra には追加で出力するテキストを渡す。"""
+    return "\n".join([metric.render() for metric in METRICS] + [text for text in extra if text]) + "\n"
+
+
+class InstrumentedPredictor:
+    def __init__(self, predictor):
+        """
+        推論器の処理時間を段階ごとに STAGE_SECONDS へ記録するラッパー。
+
+        推論器が to_tensor()・forward_tensor()・to_numpy() を持つ場合 (ModelBundle) は、
+        デバイスへの転送 (transfer)・順伝播 (forward)・NumPy への取り出し (fetch) を分けて記録し、
+        それ以外は全体を forward として記録する。
+        マイクロバッチングが有効な場合はバッチ単位で記録される。
+
+        Args:
+            predictor: features・version・predict() を持つ推論器。
+        """
+        self.predictor = predictor
+        self.features = predictor.features
+        self.version = predictor.version
+        self._staged = all(hasattr(predictor, name) for name in ("to_tensor", "forward_tensor", "to_numpy"))
+
+    def predict(self, X):
+        ROWS_TOTAL.inc(self.version, amount=len(X))
+        if not self._staged:
+            with STAGE_SECONDS.time("forward"):
+                return self.predictor.predict(X)
+        with STAGE_SECONDS.time("transfer"):
+            input_tensor = self.predictor.to_tensor(X)
+        with STAGE_SECONDS.time("forward"):
+            output = self.predictor.forward_tensor(input_tensor)
+        with STAGE_SECONDS.time("fetch"):
+            return self.predictor.to_numpy(output)
+
+
+class SamplingProfiler:
+    def __init__(self, sample_rate, output_dir):
+        """
+        一部のリクエストだけを cProfile で計測し、結果を output_dir に .prof ファイルとして保存する。
+
+        Args:
+            sample_rate (float): 計測するリクエストの割合 (0 の場合は計測しない)。
+            output_dir (str): 計測結果の保存先。
+        """
+        self.sample_rate = sample_rate
+        self.output_dir = output_dir
+        self._lock = threading.Lock()  # cProfile は同時に 1 つしか有効にできない
+
+    @contextmanager
+    def maybe_profile(self, name):
+        """sample_rate の確率で with ブロックを計測する。"""
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate or not self._lock.acquire(blocking=False):
+            yield
+            return
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+            os.makedirs(self.output_dir, exist_ok=True)
+            profiler.dump_stats(os.path.join(self.output_dir, f"{name}-{os.getpid()}-{time.time_ns()}.prof"))
+        finally:
+            self._lock.release()
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# テスト対象のモジュールはパッケージではなく、このディレクトリの親に直接置かれている
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# model_serve は import 時にモデルを読み込むため、作業ディレクトリのモデルバンドルを使わないようにする
+os.environ.setdefault("MODEL_BUNDLE_PATH", os.path.join(os.path.dirname(__file__), "missing_bundle.pth"))
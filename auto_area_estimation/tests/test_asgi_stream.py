@@ -0,0 +1,114 @@
+import asyncio
+import json
+
+import numpy as np
+import pyarrow as pa
+import pytest
+
+import asgi_serve
+import model_serve
+from model_bundle import DEFAULT_FEATURES, LinearRegressionModel, ModelBundle
+from model_registry import ModelRegistry
+from model_serve import ARROW_STREAM_MIMETYPE, BINARY_MIMETYPE, MODEL_VERSION_HEADER, NDJSON_MIMETYPE
+
+
+@pytest.fixture
+def bundle(monkeypatch):
+    monkeypatch.setattr(model_serve, "micro_batch_window_ms", 0.0)
+    monkeypatch.setattr(model_serve, "STREAM_CHUNK_ROWS", 3)
+    registry = ModelRegistry(wrap=model_serve._wrap_predictor)
+    monkeypatch.setattr(model_serve, "registry", registry)
+    model = LinearRegressionModel(len(DEFAULT_FEATURES), 1)
+    bundle = ModelBundle(model.state_dict(), np.zeros(len(DEFAULT_FEATURES)), np.ones(len(DEFAULT_FEATURES)),
+                         DEFAULT_FEATURES, "v1")
+    registry.register(bundle)
+    return bundle
+
+
+def _post(path, body_chunks, content_type, accept=None):
+    """ASGI アプリに本文を分割して送り、(ステータス, ヘッダー, 本文) を返す。"""
+    scope = {"type": "http", "method": "POST", "path": path,
+             "headers": [(b"content-type", content_type.encode("latin-1"))]}
+    if accept is not None:
+        scope["headers"].append((b"accept", accept.encode("latin-1")))
+    messages = [{"type": "http.request", "body": chunk, "more_body": i < len(body_chunks) - 1}
+                for i, chunk in enumerate(body_chunks)]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(asgi_serve.app(scope, receive, send))
+    start = sent[0]
+    body = b"".join(message.get("body", b"") for message in sent[1:])
+    return start["status"], dict(start["headers"]), body
+
+
+def _matrix(n_rows=7):
+    return np.random.default_rng(0).normal(size=(n_rows, len(DEFAULT_FEATURES))).astype(np.float32)
+
+
+def test_ndjson_stream(bundle):
+    X = _matrix()
+    lines = "".join(json.dumps(dict(zip(DEFAULT_FEATURES, map(float, row)))) + "\n" for row in X).encode("utf-8")
+    # 行の途中で分割された本文も正しく読み込めること
+    status, headers, body = _post("/predict/stream", [lines[i:i + 50] for i in range(0, len(lines), 50)],
+                                  NDJSON_MIMETYPE)
+
+    assert status == 200
+    assert headers[b"content-type"] == NDJSON_MIMETYPE.encode()
+    assert headers[MODEL_VERSION_HEADER.lower().encode()] == b"v1"
+    chunks = [json.loads(line) for line in body.decode("utf-8").splitlines()]
+    predictions = [p for chunk in chunks for p in chunk["predicted_area_auto"]]
+    np.testing.assert_allclose(predictions, bundle.predict(X), rtol=1e-5, atol=1e-6)
+
+
+def test_arrow_stream(bundle):
+    X = _matrix()
+    table = pa.table({f: X[:, i] for i, f in enumerate(DEFAULT_FEATURES)})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        for batch in table.to_batches(max_chunksize=3):
+            writer.write_batch(batch)
+    data = sink.getvalue().to_pybytes()
+    status, headers, body = _post("/predict/stream", [data[:100], data[100:]], ARROW_STREAM_MIMETYPE)
+
+    assert status == 200
+    assert headers[b"content-type"] == ARROW_STREAM_MIMETYPE.encode()
+    result = pa.ipc.open_stream(body).read_all()
+    np.testing.assert_allclose(result.column("predicted_area_auto").to_numpy(), bundle.predict(X), rtol=1e-5, atol=1e-6)
+
+
+def test_stream_with_missing_features_returns_400(bundle):
+    line = json.dumps({f: 1.0 for f in DEFAULT_FEATURES[1:]}).encode("utf-8") + b"\n"
+    status, headers, body = _post("/predict/stream", [line], NDJSON_MIMETYPE)
+
+    assert status == 400
+    assert "error" in json.loads(body)
+
+
+@pytest.mark.parametrize("accept, binary", [
+    (BINARY_MIMETYPE, True),
+    (f"application/json;q=0.5, {BINARY_MIMETYPE}", True),
+    (f"application/json, {BINARY_MIMETYPE};q=0.5", False),
+    (f"{BINARY_MIMETYPE};q=0.2, application/json;q=0.8", False),
+    (None, False),
+])
+def test_predict_accept_matches_flask(bundle, accept, binary):
+    X = _matrix()
+    body = json.dumps([dict(zip(DEFAULT_FEATURES, map(float, row))) for row in X]).encode("utf-8")
+    status, headers, response = _post("/predict", [body], "application/json", accept)
+
+    assert status == 200
+    # Flask 版と同じく q 値の高い形式で応答すること
+    flask_response = model_serve.app.test_client().post("/predict", data=body, content_type="application/json",
+                                                        headers={"Accept": accept} if accept else {})
+    assert headers[b"content-type"] == flask_response.content_type.encode()
+    if binary:
+        assert headers[b"content-type"] == BINARY_MIMETYPE.encode()
+        np.testing.assert_allclose(np.frombuffer(response, dtype="<f4"), bundle.predict(X).ravel(), rtol=1e-5, atol=1e-6)
+    else:
+        assert headers[b"content-type"] == b"application/json"
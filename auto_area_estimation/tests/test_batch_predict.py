@@ -0,0 +1,36 @@
+import h5py
+import numpy as np
+import pytest
+
+from batch_predict import predict_file
+from model_bundle import DEFAULT_FEATURES, FusedLinearModel
+
+
+@pytest.fixture
+def model_path(tmp_path):
+    path = str(tmp_path / "model.npz")
+    FusedLinearModel(np.arange(len(DEFAULT_FEATURES)), 0.5, DEFAULT_FEATURES, "v1").save(path)
+    return path
+
+
+def _write(path, keys, n_rows=5):
+    X = np.random.default_rng(0).normal(size=(n_rows, len(keys)))
+    with h5py.File(path, "w") as f:
+        for i, key in enumerate(keys):
+            f.create_dataset(key, data=X[:, i])
+    return X
+
+
+def test_predict_file(tmp_path, model_path):
+    data_path = str(tmp_path / "data.hdf5")
+    X = _write(data_path, DEFAULT_FEATURES)
+    predictions = predict_file(data_path, model_path, chunk_rows=2)
+    np.testing.assert_allclose(predictions, X @ np.arange(len(DEFAULT_FEATURES)) + 0.5, rtol=1e-5)
+
+
+@pytest.mark.parametrize("missing", [DEFAULT_FEATURES[0], DEFAULT_FEATURES[-1]])
+def test_missing_feature_raises_key_error(tmp_path, model_path, missing):
+    data_path = str(tmp_path / "data.hdf5")
+    _write(data_path, [key for key in DEFAULT_FEATURES if key != missing])
+    with pytest.raises(KeyError, match="Missing required features"):
+        predict_file(data_path, model_path)
@@ -0,0 +1,152 @@
+import h5py
+import numpy as np
+import pytest
+import torch
+from torch.utils.data import DataLoader
+
+from custom_dataset import HDF5Dataset, batch_loader
+
+FEATURES = ["flux_radius", "mag"]
+TARGET = "area"
+
+
+@pytest.fixture
+def data_path(tmp_path):
+    path = str(tmp_path / "catalog.hdf5")
+    rng = np.random.default_rng(0)
+    with h5py.File(path, "w") as f:
+        for key in FEATURES + [TARGET]:
+            f.create_dataset(key, data=rng.normal(size=10).astype(">f8"), chunks=(4,), compression="gzip")
+    return path
+
+
+def _expected(path, keys):
+    with h5py.File(path, "r") as f:
+        return np.stack([f[key][()] for key in keys], axis=1).astype(np.float32)
+
+
+@pytest.mark.parametrize("target", [TARGET, None])
+@pytest.mark.parametrize("cache", [None, "memory"])
+def test_dataloader_batches_match_the_file(data_path, target, cache):
+    dataset = HDF5Dataset(data_path, FEATURES + [TARGET], features=FEATURES, target=target, cache=cache)
+    X = _expected(data_path, FEATURES)
+    y = _expected(data_path, [TARGET])[:, 0]
+
+    # 自動バッチング (__getitems__ と既定の collate_fn) と batch_loader() のどちらでも同じバッチになる
+    for loader in [DataLoader(dataset, batch_size=4), batch_loader(dataset, batch_size=4)]:
+        batches = list(loader)
+        assert len(batches) == 3
+        if target is None:
+            assert all(isinstance(batch, torch.Tensor) for batch in batches)
+            np.testing.assert_allclose(torch.cat(batches).numpy(), X, rtol=1e-6)
+        else:
+            np.testing.assert_allclose(torch.cat([b[0] for b in batches]).numpy(), X, rtol=1e-6)
+            np.testing.assert_allclose(torch.cat([b[1] for b in batches]).numpy(), y, rtol=1e-6)
+
+
+def test_batch_loader_shuffles_every_row_once(data_path):
+    dataset = HDF5Dataset(data_path, FEATURES + [TARGET])
+    batches = list(batch_loader(dataset, batch_size=3, shuffle=True, drop_last=True))
+    assert [len(batch[TARGET]) for batch in batches] == [3, 3, 3]
+    values = torch.cat([batch[TARGET] for batch in batches]).numpy()
+    assert len(np.unique(values)) == 9
+    assert np.isin(values, _expected(data_path, [TARGET])[:, 0].astype(np.float32)).all()
+
+
+def test_arrow_dataset_matches_hdf5(data_path, tmp_path):
+    from custom_dataset import ArrowDataset
+    from hdf5_to_parquet import convert
+
+    assert convert(data_path, str(tmp_path / "parquet"), row_group_rows=4, rows_per_file=6) == 10
+    hdf5 = HDF5Dataset(data_path, FEATURES + [TARGET], features=FEATURES, target=TARGET)
+    arrow = ArrowDataset(str(tmp_path / "parquet"), FEATURES + [TARGET], features=FEATURES, target=TARGET)
+    assert len(arrow) == len(hdf5)
+    for expected, actual in zip(hdf5.get_batch(np.arange(10)), arrow.get_batch(np.arange(10))):
+        np.testing.assert_array_equal(actual.numpy(), expected.numpy())
+
+
+def test_convert_empty_file(tmp_path):
+    from custom_dataset import ArrowDataset
+    from hdf5_to_parquet import convert
+
+    path = str(tmp_path / "empty.hdf5")
+    with h5py.File(path, "w") as f:
+        for key in FEATURES:
+            f.create_dataset(key, shape=(0,), dtype="f8")
+        f.create_dataset("image_band", shape=(0, 3), dtype="S8")
+
+    assert convert(path, str(tmp_path / "parquet")) == 0
+    dataset = ArrowDataset(str(tmp_path / "parquet"), FEATURES + ["image_band"])
+    assert len(dataset) == 0
+
+
+def test_chunk_shuffled_opens_the_file_once(data_path, monkeypatch):
+    import threading
+    import time
+
+    import custom_dataset
+    from custom_dataset import ChunkShuffledHDF5Dataset
+
+    dataset = HDF5Dataset(data_path, FEATURES + [TARGET], features=FEATURES, target=TARGET, mmap=False)
+    opened = []
+    original = h5py.File
+
+    def slow_open(*args, **kwargs):
+        opened.append(threading.get_ident())
+        time.sleep(0.05)  # 先読みのスレッドが同時に開こうとする状況を作る
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(custom_dataset.h5py, "File", slow_open)
+    loader = ChunkShuffledHDF5Dataset(dataset, batch_size=4, chunk_rows=2, num_threads=4, seed=0)
+    y = torch.cat([batch[1] for batch in loader]).numpy()
+    assert len(opened) == 1
+    np.testing.assert_allclose(np.sort(y), np.sort(_expected(data_path, [TARGET])[:, 0]), rtol=1e-6)
+
+
+def test_chunk_shuffled_arrow_dataset(data_path, tmp_path):
+    from custom_dataset import ArrowDataset, ChunkShuffledHDF5Dataset
+    from hdf5_to_parquet import convert
+
+    convert(data_path, str(tmp_path / "parquet"), row_group_rows=4)
+    dataset = ArrowDataset(str(tmp_path / "parquet"), FEATURES + [TARGET], features=FEATURES, target=TARGET)
+    loader = ChunkShuffledHDF5Dataset(dataset, batch_size=3, seed=0)
+    assert loader.chunk_rows == 4
+    y = torch.cat([batch[1] for batch in loader]).numpy()
+    np.testing.assert_allclose(np.sort(y), np.sort(_expected(data_path, [TARGET])[:, 0]), rtol=1e-6)
+
+
+@pytest.mark.parametrize("seed", [None, 0])
+def test_chunk_shuffled_workers_cover_every_row_once(tmp_path, seed):
+    from custom_dataset import ChunkShuffledHDF5Dataset
+
+    path = str(tmp_path / "rows.hdf5")
+    with h5py.File(path, "w") as f:
+        f.create_dataset("row", data=np.arange(64, dtype="f8"), chunks=(4,))
+    loader = ChunkShuffledHDF5Dataset(HDF5Dataset(path, ["row"], features=["row"]), batch_size=8, chunk_rows=4,
+                                      seed=seed)
+
+    orders = []
+    for epoch in range(2):
+        loader.set_epoch(epoch)
+        rows = torch.cat(list(DataLoader(loader, batch_size=None, num_workers=2)))[:, 0].numpy()
+        np.testing.assert_array_equal(np.sort(rows), np.arange(64))
+        orders.append(rows)
+    # set_epoch() で指定したエポックごとに順序が変わる
+    assert not np.array_equal(orders[0], orders[1])
+
+
+def test_convert_replaces_previous_parts(data_path, tmp_path):
+    from custom_dataset import ArrowDataset
+    from hdf5_to_parquet import convert
+
+    output = str(tmp_path / "parquet")
+    convert(data_path, output, rows_per_file=3)
+    convert(data_path, output)
+    assert len(ArrowDataset(output, FEATURES)) == 10
+
+
+def test_convert_without_columns(data_path, tmp_path):
+    from hdf5_to_parquet import convert
+
+    with pytest.raises(ValueError, match="No columns"):
+        convert(data_path, str(tmp_path / "parquet"), columns=[])
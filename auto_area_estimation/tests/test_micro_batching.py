@@ -0,0 +1,61 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+import model_serve
+from micro_batcher import MicroBatcher
+from model_bundle import DEFAULT_FEATURES, LinearRegressionModel, ModelBundle
+from model_registry import ModelRegistry
+from model_serve import LegacyPredictor
+
+
+def _rows(seed, n_rows):
+    rng = np.random.default_rng(seed)
+    return [{f: float(v) for f, v in zip(DEFAULT_FEATURES, row)} for row in rng.normal(size=(n_rows, len(DEFAULT_FEATURES)))]
+
+
+def _use_registry(monkeypatch, window_ms):
+    monkeypatch.setattr(model_serve, "micro_batch_window_ms", window_ms)
+    registry = ModelRegistry(wrap=model_serve._wrap_predictor)
+    monkeypatch.setattr(model_serve, "registry", registry)
+    return registry
+
+
+def test_legacy_predictor_is_not_micro_batched(monkeypatch):
+    registry = _use_registry(monkeypatch, 200.0)
+    torch.manual_seed(0)
+    predictor = LegacyPredictor(LinearRegressionModel(len(DEFAULT_FEATURES), 1).eval())
+    entry = registry.register(predictor)
+    assert not isinstance(entry.runner, MicroBatcher)
+
+    # 2 つのリクエストを同時に送り、それぞれ単独で推論した場合と同じ予測値になることを確認する
+    requests = [_rows(1, 3), _rows(2, 5)]
+    expected = [predictor.predict(model_serve.rows_to_matrix(rows, DEFAULT_FEATURES)) for rows in requests]
+    barrier = threading.Barrier(len(requests))
+
+    def post(rows):
+        client = model_serve.app.test_client()
+        barrier.wait()
+        return client.post("/predict", json=rows)
+
+    with ThreadPoolExecutor(len(requests)) as executor:
+        responses = list(executor.map(post, requests))
+    for response, predictions in zip(responses, expected):
+        assert response.status_code == 200
+        np.testing.assert_allclose(response.get_json()["predicted_area_auto"], predictions, rtol=1e-5, atol=1e-6)
+
+
+def test_bundle_is_micro_batched(monkeypatch):
+    registry = _use_registry(monkeypatch, 200.0)
+    model = LinearRegressionModel(len(DEFAULT_FEATURES), 1)
+    bundle = ModelBundle(model.state_dict(), np.zeros(len(DEFAULT_FEATURES)), np.ones(len(DEFAULT_FEATURES)),
+                         DEFAULT_FEATURES, "v1")
+    entry = registry.register(bundle)
+    try:
+        assert isinstance(entry.runner, MicroBatcher)
+        X = model_serve.rows_to_matrix(_rows(3, 4), DEFAULT_FEATURES)
+        np.testing.assert_allclose(entry.predict(X), bundle.predict(X), rtol=1e-6)
+    finally:
+        entry.close()
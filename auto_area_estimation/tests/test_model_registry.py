@@ -0,0 +1,56 @@
+import os
+
+import numpy as np
+import pytest
+
+from model_bundle import DEFAULT_FEATURES, FusedLinearModel
+from model_registry import ModelRegistry, UnknownModelVersionError
+
+
+def _save(model_dir, name, version, bias, mtime):
+    path = os.path.join(model_dir, name)
+    FusedLinearModel(np.zeros(len(DEFAULT_FEATURES)), bias, DEFAULT_FEATURES, version).save(path)
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_shadow_is_not_the_default_version(tmp_path):
+    _save(tmp_path, "v1.npz", "v1", 1.0, 1000)
+    _save(tmp_path, "v2.npz", "v2", 2.0, 2000)
+    registry = ModelRegistry(model_dir=str(tmp_path), shadow_version="v2")
+    registry.scan()
+
+    # 最も新しいファイルがシャドーモデルでも、既定のモデルにはならない
+    assert registry.resolve().version == "v1"
+    assert registry.versions()["active"] == "v1"
+
+
+def test_only_shadow_fails_loudly(tmp_path):
+    _save(tmp_path, "v2.npz", "v2", 2.0, 2000)
+    registry = ModelRegistry(model_dir=str(tmp_path), shadow_version="v2")
+    with pytest.raises(RuntimeError, match="shadow"):
+        registry.start()
+    with pytest.raises(UnknownModelVersionError, match="shadow"):
+        registry.resolve()
+    assert registry.resolve("v2").version == "v2"
+
+
+def test_duplicate_versions_are_not_reloaded(tmp_path, capsys):
+    _save(tmp_path, "a.npz", "v1", 1.0, 1000)
+    newer = _save(tmp_path, "b.npz", "v1", 2.0, 2000)
+    registry = ModelRegistry(model_dir=str(tmp_path))
+    registry.scan()
+    entry = registry.resolve("v1")
+    assert entry.path == newer
+    assert "same model version" in capsys.readouterr().out
+
+    # 監視のたびに 2 つのファイルが交互に読み込まれない
+    for _ in range(3):
+        registry.scan()
+        assert registry.resolve("v1") is entry
+
+    # 採用したファイルが削除された場合は、残りのファイルを読み込む
+    os.remove(newer)
+    registry.scan()
+    assert registry.resolve("v1").path == os.path.join(tmp_path, "a.npz")
+    assert registry.predict(registry.resolve("v1"), np.zeros((1, len(DEFAULT_FEATURES))))[0] == 1.0
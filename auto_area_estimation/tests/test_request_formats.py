@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+import model_serve
+from model_bundle import DEFAULT_FEATURES, LinearRegressionModel, ModelBundle
+from model_registry import ModelRegistry
+from model_serve import BINARY_MIMETYPE, COLUMNS_HEADER
+
+
+@pytest.fixture
+def bundle(monkeypatch):
+    monkeypatch.setattr(model_serve, "micro_batch_window_ms", 0.0)
+    registry = ModelRegistry(wrap=model_serve._wrap_predictor)
+    monkeypatch.setattr(model_serve, "registry", registry)
+    model = LinearRegressionModel(len(DEFAULT_FEATURES), 1)
+    bundle = ModelBundle(model.state_dict(), np.zeros(len(DEFAULT_FEATURES)), np.ones(len(DEFAULT_FEATURES)),
+                         DEFAULT_FEATURES, "v1")
+    registry.register(bundle)
+    return bundle
+
+
+@pytest.fixture
+def client(bundle):
+    return model_serve.app.test_client()
+
+
+def _matrix(n_rows=4):
+    return np.random.default_rng(0).normal(size=(n_rows, len(DEFAULT_FEATURES))).astype(np.float32)
+
+
+def test_rows_columns_and_binary_give_the_same_predictions(client, bundle):
+    X = _matrix()
+    expected = bundle.predict(X)
+    rows = [dict(zip(DEFAULT_FEATURES, map(float, row))) for row in X]
+    columns = {f: X[:, i].tolist() for i, f in enumerate(DEFAULT_FEATURES)}
+
+    for response in [client.post("/predict", json=rows), client.post("/predict", json=columns)]:
+        assert response.status_code == 200
+        np.testing.assert_allclose(response.get_json()["predicted_area_auto"], expected, rtol=1e-5)
+
+    response = client.post("/predict", data=X.astype("<f4").tobytes(), content_type=BINARY_MIMETYPE,
+                           headers={COLUMNS_HEADER: ",".join(DEFAULT_FEATURES), "Accept": BINARY_MIMETYPE})
+    assert response.status_code == 200
+    np.testing.assert_allclose(np.frombuffer(response.data, dtype="<f4"), expected, rtol=1e-5)
+
+
+@pytest.mark.parametrize("payload", [
+    [1, 2, 3],
+    [{f: 1.0 for f in DEFAULT_FEATURES}, "row"],
+    [[1.0] * len(DEFAULT_FEATURES)],
+    {f: [1.0, 2.0] if i else [1.0] for i, f in enumerate(DEFAULT_FEATURES)},
+    [{f: 1.0 for f in DEFAULT_FEATURES[1:]}],
+    [],
+])
+def test_malformed_json_returns_400(client, payload):
+    response = client.post("/predict", json=payload)
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+
+def test_malformed_binary_returns_400(client):
+    body = _matrix().astype("<f4").tobytes()
+    headers = {COLUMNS_HEADER: ",".join(DEFAULT_FEATURES)}
+    assert client.post("/predict", data=body[:-2], content_type=BINARY_MIMETYPE, headers=headers).status_code == 400
+    assert client.post("/predict", data=body, content_type=BINARY_MIMETYPE).status_code == 400
+    headers = {COLUMNS_HEADER: ",".join(DEFAULT_FEATURES[1:])}
+    assert client.post("/predict", data=body, content_type=BINARY_MIMETYPE, headers=headers).status_code == 400
+
+
+def test_ndjson_stream_rejects_non_object_rows(client):
+    response = client.post("/predict/stream", data="[1, 2, 3]\n", content_type=model_serve.NDJSON_MIMETYPE)
+    assert response.status_code == 400
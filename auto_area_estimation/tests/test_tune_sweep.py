@@ -0,0 +1,48 @@
+import h5py
+import numpy as np
+import pytest
+from sklearn.preprocessing import StandardScaler
+
+from model_bundle import TARGET
+from tune_sweep import load_sweep_data, selected_features, trial_data
+
+FEATURES = ["mag_auto", "mag_iso", "npix"]
+
+
+@pytest.fixture
+def data_path(tmp_path):
+    path = str(tmp_path / "catalog.hdf5")
+    rng = np.random.default_rng(0)
+    columns = {key: rng.normal(size=50) for key in FEATURES + [TARGET]}
+    columns["npix"][:10] = np.nan  # 試行によっては使わない特徴量の欠損値
+    columns["mag_iso"][10] = np.nan
+    columns[TARGET][11] = np.nan
+    with h5py.File(path, "w") as f:
+        for key, values in columns.items():
+            f.create_dataset(key, data=values)
+    return path
+
+
+def test_selected_features():
+    config = {"use_npix": True, "use_mag_iso": False}
+    assert selected_features(config, FEATURES) == ["mag_auto", "npix"]
+    assert selected_features({}, FEATURES) == ["mag_auto"]
+
+
+def test_trial_data_drops_rows_per_selected_features(data_path):
+    data = load_sweep_data(data_path, FEATURES)
+    # ターゲットが欠損値の行だけを共通で除き、特徴量の欠損値は残す
+    assert len(data["X_train"]) + len(data["X_test"]) == 49
+    assert np.isnan(data["X_train"]).any() or np.isnan(data["X_test"]).any()
+
+    for features, n_rows in [(["mag_auto"], 49), (["mag_auto", "mag_iso"], 48), (FEATURES, 38)]:
+        X_train, X_test, y_train, y_test = trial_data(data, features)
+        assert len(X_train) + len(X_test) == n_rows
+        assert len(X_train) == len(y_train) and len(X_test) == len(y_test)
+        assert not np.isnan(X_train).any() and not np.isnan(X_test).any()
+
+        # 選んだ列だけで欠損値を除いて標準化した場合と同じ値になる
+        columns = [FEATURES.index(f) for f in features]
+        raw = data["X_train"][:, columns]
+        expected = StandardScaler().fit_transform(raw[~np.isnan(raw).any(axis=1)])
+        np.testing.assert_allclose(X_train, expected, rtol=1e-5, atol=1e-6)
@@ -0,0 +1,256 @@
+import argparse
+import datetime
+import json
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import StandardScaler
+
+from custom_dataset import HDF5Dataset
+from model_bundle import LinearRegressionModel, TARGET
+
+# 探索で使用できる特徴量 (ceers_training.ipynb の Ray Tune のセルと同じ)
+SWEEP_FEATURES = [
+    'mag_auto', 'mag_iso', 'area_iso', 'kron_radius', 'npix',
+    'xmax', 'xmin', 'ymax', 'ymin',
+    'x2_image', 'y2_image', 'xy_image',
+    'flux_auto', 'flux_iso', 'flux_aper_0', 'flux_aper_1', 'flux_aper_2',
+    'flux_radius', 'flux_radius_20', 'flux_radius_90',
+]
+
+# 常に使用する特徴量
+BASE_FEATURES = ['mag_auto']
+
+
+def load_sweep_data(data_path, features, target=TARGET, test_size=0.2, random_state=42):
+    """
+    HDF5 ファイルから特徴量とターゲットを 1 度だけ読み込み、学習用とテスト用に分割する。
+
+    特徴量の欠損値 (NaN) はそのまま残し、試行ごとに trial_data() で選んだ列に欠損値のある行だけを除いてから標準化する
+    (ceers_training.ipynb で特徴量を選んだ後に df.dropna() する場合と同じ行・同じ標準化になる)。
+    ターゲットが欠損値の行はどの試行でも使えないため、ここで除く。
+    学習用とテスト用の分割は全ての試行で共通 (同じ行は常に同じ側) にする。
+
+    Args:
+        data_path (str): HDF5 ファイルのパス。
+        features (list): 読み込む特徴量の列名。
+        target (str): ターゲットの列名。
+        test_size (float): テスト用データの割合。
+        random_state (int): 分割の乱数のシード。
+
+    Returns:
+        dict: X_train・X_test (標準化前の float32 の行列、欠損値を含む)、y_train・y_test (float32 のベクトル)、features。
+    """
+    dataset = HDF5Dataset(data_path, features + [target], features=features, target=target)
+    X, y = (t.numpy() for t in dataset.get_batch(np.arange(len(dataset))))
+    dataset.close()
+
+    valid = ~np.isnan(y)
+    X_train, X_test, y_train, y_test = train_test_split(X[valid], y[valid], test_size=test_size, random_state=random_state)
+    return {
+        "X_train": X_train,
+        "X_test": X_test,
+        "y_train": y_train.reshape(-1, 1),
+        "y_test": y_test.reshape(-1, 1),
+        "features": list(features),
+    }
+
+
+def trial_data(data, features):
+    """
+    load_sweep_data() の結果から、1 試行で使う特徴量の列を取り出して学習用・テスト用の行列を作成する。
+
+    選んだ列に欠損値のある行を除き (df.dropna() と同じ)、残った学習用の行で標準化する。
+
+    Args:
+        data (dict): load_sweep_data() の結果。
+        features (list): 試行で使う特徴量 (data["features"] に含まれること)。
+
+    Returns:
+        tuple: 標準化した X_train・X_test (float32 の行列) と y_train・y_test (形状 (n, 1) の float32 の行列)。
+    """
+    columns = [data["features"].index(f) for f in features]
+    # オブジェクトストアの配列は読み取り専用のため、列を選ぶ際のコピーに対して処理する
+    X_train, X_test = data["X_train"][:, columns], data["X_test"][:, columns]
+    train_rows, test_rows = ~np.isnan(X_train).any(axis=1), ~np.isnan(X_test).any(axis=1)
+    scaler = StandardScaler()
+    return (
+        scaler.fit_transform(X_train[train_rows]).astype(np.float32),
+        scaler.transform(X_test[test_rows]).astype(np.float32),
+        data["y_train"][train_rows],
+        data["y_test"][test_rows],
+    )
+
+
+def selected_features(config, features):
+    """config の use_<特徴量> が True の特徴量と BASE_FEATURES を、features の順で返す。"""
+    return [f for f in features if f in BASE_FEATURES or config.get(f"use_{f}", False)]
+
+
+def train_trial(config, data=None):
+    """
+    Ray Tune の 1 試行。オブジェクトストアの学習データから config で選んだ特徴量の列を取り出して学習する。
+
+    Args:
+        config (dict): learning_rate・epochs・cpus_per_trial・use_<特徴量> を含む試行の設定。
+        data (dict): load_sweep_data() の結果 (tune.with_parameters でオブジェクトストア経由で渡される)。
+    """
+    from ray import tune
+
+    start_time = time.time()
+    # 試行ごとに割り当てた CPU 数だけスレッドを使い、試行を並列に実行する
+    torch.set_num_threads(config.get("cpus_per_trial", 1))
+
+    features = selected_features(config, data["features"])
+    X_train, X_test, y_train, y_test = (torch.from_numpy(a) for a in trial_data(data, features))
+
+    model = LinearRegressionModel(len(features), 1)
+    criterion = nn.MSELoss()
+    optimizer = torch.optim.Adam(model.parameters(), lr=config["learning_rate"])
+
+    best_loss = float('inf')
+    for epoch in range(config["epochs"]):
+        model.train()
+        loss = criterion(model(X_train), y_train)
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+
+        model.eval()
+        with torch.no_grad():
+            test_loss = criterion(model(X_test), y_test).item()
+        best_loss = min(best_loss, test_loss)
+
+        elapsed = time.time() - start_time
+        tune.report({
+            "loss": test_loss,
+            "train_loss": loss.item(),
+            "best_loss": best_loss,
+            "epoch": epoch,
+            "n_features": len(features),
+            "trial_wall_time": elapsed,
+            "rows_per_second": (epoch + 1) * len(X_train) / max(elapsed, 1e-9),
+        })
+
+
+def build_param_space(search_features, learning_rates, epochs, cpus_per_trial):
+    """
+    探索空間を作成する。search_features の特徴量は使う・使わないの両方を、学習率はグリッドで探索する。
+    """
+    from ray import tune
+
+    config = {
+        "learning_rate": tune.grid_search(learning_rates),
+        "epochs": epochs,
+        "cpus_per_trial": cpus_per_trial,
+    }
+    for feature in SWEEP_FEATURES:
+        if feature in BASE_FEATURES:
+            continue
+        config[f"use_{feature}"] = tune.grid_search([True, False]) if feature in search_features else False
+    return config
+
+
+def run_sweep(data_path, search_features, learning_rates, epochs, cpus_per_trial=1, grace_period=10,
+              num_cpus=None, name=None):
+    """
+    学習データを 1 度だけ読み込んでオブジェクトストアに置き、全ての試行を ASHA で早期打ち切りしながら並列に実行する。
+
+    Args:
+        data_path (str): HDF5 ファイルのパス。
+        search_features (list): 使う・使わないを探索する特徴量。
+        learning_rates (list): 探索する学習率。
+        epochs (int): 1 試行の最大エポック数。
+        cpus_per_trial (int): 1 試行に割り当てる CPU 数。
+        grace_period (int): ASHA で打ち切りを判定し始めるまでのエポック数。
+        num_cpus (int, optional): Ray に使わせる CPU 数。省略時は全てのコア。
+        name (str, optional): 実験名。
+
+    Returns:
+        ray.tune.ResultGrid: 全ての試行の結果。
+    """
+    import ray
+    from ray import tune
+    from ray.tune.schedulers import ASHAScheduler
+
+    load_start = time.time()
+    data = load_sweep_data(data_path, SWEEP_FEATURES)
+    print(f"Loaded {len(data['X_train'])} training rows in {time.time() - load_start:.2f} s")
+
+    ray.init(num_cpus=num_cpus, ignore_reinit_error=True)
+    scheduler = ASHAScheduler(
+        metric="loss",
+        mode="min",
+        max_t=epochs,
+        grace_period=min(grace_period, epochs),
+        reduction_factor=2,
+    )
+    # tune.with_parameters で学習データをオブジェクトストアに 1 度だけ置き、各試行はそれを共有して参照する
+    trainable = tune.with_resources(tune.with_parameters(train_trial, data=data), resources={"cpu": cpus_per_trial})
+    tuner = tune.Tuner(
+        trainable,
+        param_space=build_param_space(search_features, learning_rates, epochs, cpus_per_trial),
+        tune_config=tune.TuneConfig(scheduler=scheduler, num_samples=1),
+        run_config=tune.RunConfig(
+            name=name or "linear_regression_sweep-" + datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S"),
+            verbose=1,
+        ),
+    )
+    return tuner.fit()
+
+
+def summarize(results):
+    """試行ごとの設定・最良の損失・実行時間・スループットをまとめたリストを返す (最良の損失の昇順)。"""
+    trials = []
+    for result in results:
+        metrics = result.metrics or {}
+        config = result.config or {}
+        trials.append({
+            "features": selected_features(config, SWEEP_FEATURES),
+            "learning_rate": config.get("learning_rate"),
+            "epochs_run": metrics.get("epoch", -1) + 1,
+            "best_loss": metrics.get("best_loss"),
+            "trial_wall_time": metrics.get("trial_wall_time"),
+            "rows_per_second": metrics.get("rows_per_second"),
+            "error": str(result.error) if result.error else None,
+        })
+    return sorted(trials, key=lambda t: float("inf") if t["best_loss"] is None else t["best_loss"])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="CEERS の面積推定モデルのハイパーパラメータを Ray Tune で並列に探索する")
+    parser.add_argument("data", help="CEERS 形式の HDF5 ファイル")
+    parser.add_argument("--search-features", default="mag_iso,area_iso,kron_radius,npix",
+                        help="使う・使わないを探索する特徴量 (カンマ区切り)")
+    parser.add_argument("--learning-rates", default="1e-4,1e-3,1e-2", help="探索する学習率 (カンマ区切り)")
+    parser.add_argument("--epochs", type=int, default=300, help="1 試行の最大エポック数")
+    parser.add_argument("--cpus-per-trial", type=int, default=1, help="1 試行に割り当てる CPU 数")
+    parser.add_argument("--grace-period", type=int, default=10, help="ASHA で打ち切りを判定し始めるまでのエポック数")
+    parser.add_argument("--num-cpus", type=int, default=None, help="Ray に使わせる CPU 数 (省略時は全てのコア)")
+    parser.add_argument("--name", default=None, help="実験名")
+    parser.add_argument("--output", default=None, help="試行ごとの結果を保存する JSON ファイル")
+    args = parser.parse_args()
+
+    sweep_start = time.time()
+    results = run_sweep(
+        args.data,
+        [f for f in args.search_features.split(",") if f],
+        [float(lr) for lr in args.learning_rates.split(",")],
+        args.epochs,
+        cpus_per_trial=args.cpus_per_trial,
+        grace_period=args.grace_period,
+        num_cpus=args.num_cpus,
+        name=args.name,
+    )
+    trials = summarize(results)
+    print(f"Finished {len(trials)} trials in {time.time() - sweep_start:.2f} s")
+    for trial in trials[:5]:
+        print(trial)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(trials, f, indent=2)
+        print(f"Trial results saved to {args.output}")